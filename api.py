@@ -4,6 +4,7 @@ import psycopg2
 from dotenv import load_dotenv
 from Crypto.Cipher import AES
 import stats
+import latest_prices
 import pandas as pd
 
 
@@ -17,6 +18,7 @@ conn = psycopg2.connect(
     user=os.getenv("PSQL_USERNAME"),
     password=os.getenv("PSQL_PASSWORD")
 )
+latest_prices.ensure_latest_prices(conn)
 
 # Database query to check if the username and password match
 def check_credentials(username, password):
@@ -459,23 +461,15 @@ def get_disc_info_last_price(disc_name):
         JSON response: A JSON response containing the disc information and last recorded price.
     """
     disc_name = disc_name.replace("-"," ")
+    latest = latest_prices.get_latest_prices(conn, name=disc_name)
+    if not latest:
+        return jsonify({'message': 'Requested disc not found'}), 404
+    name, band, date, price = latest[0]
     with conn.cursor() as cur:
-        query = """
-            SELECT discs.name, bands.name, bands.summary, disc_prices.values, disc_prices.date
-            FROM Discs
-            JOIN bands ON discs.band = bands.name
-            JOIN disc_prices ON disc_prices.name = discs.name
-            WHERE LOWER(discs.name) = LOWER(%s)
-            ORDER BY disc_prices.date DESC
-            LIMIT 1;
-        """
-        cur.execute(query, (disc_name,))
-        info = cur.fetchone()
-        # sprint(info)
-        if not info:
-            return jsonify({'message': 'Requested disc not found'}), 404
-        response = {'disc_name': info[0], 'band': info[1], 'band_summary': info[2], 'latest_price':info[3], 'price_date':info[4].strftime("%Y-%m-%d")}
-        return jsonify({"disc":response}), 200
+        cur.execute("SELECT summary FROM bands WHERE name = %s", (band,))
+        summary = cur.fetchone()[0]
+    response = {'disc_name': name, 'band': band, 'band_summary': summary, 'latest_price':price, 'price_date':date.strftime("%Y-%m-%d")}
+    return jsonify({"disc":response}), 200
 
 
 @app.route('/info/bands/<string:band_name>', methods=['GET'])
@@ -0,0 +1,160 @@
+import argparse
+import json
+import random
+import time
+import tracemalloc
+import numpy as np
+from genetic import FitnessCache, fitness, knapsack_dp, run_evolution, run_evolution_array, solve_batched_knapsacks, user_seed
+
+# offline knapsack workload (no database needed): the budget and the want level of 50 discs for every user,
+# and the price of the discs.
+USER_MONEY_RATES_FILE = "files/user_money_rates.csv"
+ALBUM_PRICE_FILE = "files/album_price.csv"
+
+SOLVERS = ("list", "array", "batched", "dp")
+
+def load_workload(wishlist_length: int, num_users: int = None, seed: int = 0) -> list:
+    """
+    Builds the users of the benchmark from the bundled csv files. Every user wants wishlist_length discs,
+    drawn (with their want level) from the 50 discs of the files, so any wishlist length can be tested.
+
+    Args:
+        wishlist_length (int): The number of wanted discs of every user.
+        num_users (int, optional): The number of users (max the rows of the files). Defaults to None (all users).
+        seed (int, optional): The seed used to draw the discs. Defaults to 0.
+
+    Returns:
+        list: The users, with their username, money and wanted discs (like genetic.load_user_wants).
+    """
+    rates = np.loadtxt(USER_MONEY_RATES_FILE, delimiter=",")
+    prices = np.loadtxt(ALBUM_PRICE_FILE)
+    if num_users:
+        rates = rates[:num_users]
+    num_discs = rates.shape[1] - 1
+    rng = np.random.default_rng(seed)
+
+    users = []
+    for i, row in enumerate(rates):
+        discs = rng.integers(num_discs, size=wishlist_length)
+        wanted = [{"name": f"disc{d}_{k}", "band": "bench", "want": row[1 + d], "price": prices[d]} for k, d in enumerate(discs)]
+        users.append({"username": f"user{i}", "money": row[0], "wanted": wanted})
+    return users
+
+def run_solver(solver: str, users: list, pop_size: int, generation_limit: int, seed: int) -> tuple:
+    """
+    Solves the knapsack of all users with a solver.
+
+    Args:
+        solver (str): The solver ("list", "array", "batched" or "dp").
+        users (list): The users of the benchmark.
+        pop_size (int): The size of the population of the genetic algorithm.
+        generation_limit (int): The number of generations of the genetic algorithm.
+        seed (int): The seed of the random generators.
+
+    Returns:
+        tuple: The genome of every user and extra statistics of the solver (dict).
+    """
+    stats = {}
+    if solver == "dp":
+        return [knapsack_dp(u["wanted"], u["money"]) for u in users], stats
+    if solver == "batched":
+        res = solve_batched_knapsacks(users, pop_size, generation_limit, rng=np.random.default_rng(seed))
+        genomes = []
+        for u, r in zip(users, res):
+            discs = set(r["discs"])
+            genomes.append([1 if (item["name"], item["band"]) in discs else 0 for item in u["wanted"]])
+        return genomes, stats
+    if solver == "array":
+        genomes = [run_evolution_array(pop_size, len(u["wanted"]), u["wanted"], u["money"], generation_limit,
+                                       np.random.default_rng(user_seed(seed, u["username"]))) for u in users]
+        return genomes, stats
+
+    random.seed(seed)
+    hits = misses = 0
+    genomes = []
+    for u in users:
+        cache = FitnessCache(u["wanted"], u["money"])
+        genomes.append(run_evolution(pop_size, len(u["wanted"]), u["wanted"], u["money"], generation_limit, cache))
+        hits += cache.hits
+        misses += cache.misses
+    stats["cache_hit_rate"] = hits / (hits + misses) if hits + misses else 0
+    return genomes, stats
+
+def benchmark(solvers, pop_sizes, generation_limits, wishlist_lengths, num_users=None, seed=0, memory=True) -> list:
+    """
+    Runs every solver over the grid of population sizes, generation limits and wishlist lengths.
+    The genetic algorithm results are compared with the exact (dynamic programming) result.
+    The peak memory is measured (with tracemalloc) in a second run, since tracing slows down the solvers.
+
+    Args:
+        solvers (list): The solvers to benchmark.
+        pop_sizes (list): The population sizes of the genetic algorithm.
+        generation_limits (list): The generation limits of the genetic algorithm.
+        wishlist_lengths (list): The wishlist lengths of the users.
+        num_users (int, optional): The number of users. Defaults to None (all users of the files).
+        seed (int, optional): The seed of the workload and the solvers. Defaults to 0.
+        memory (bool, optional): Whether to measure the peak memory. Defaults to True.
+
+    Returns:
+        list: One result dictionary per (solver, wishlist length, population size, generation limit).
+    """
+    results = []
+    for length in wishlist_lengths:
+        users = load_workload(length, num_users, seed)
+        optimal = [fitness(genome, u["wanted"], u["money"]) for u, genome in zip(users, run_solver("dp", users, 0, 0, seed)[0])]
+        for solver in solvers:
+            # the exact solver does not depend on the genetic algorithm settings.
+            grid = [(None, None)] if solver == "dp" else [(p, g) for p in pop_sizes for g in generation_limits]
+            for pop_size, generation_limit in grid:
+                start = time.perf_counter()
+                genomes, stats = run_solver(solver, users, pop_size, generation_limit, seed)
+                wall_time = time.perf_counter() - start
+                peak_memory = None
+                if memory:
+                    tracemalloc.start()
+                    run_solver(solver, users, pop_size, generation_limit, seed)
+                    peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                    tracemalloc.stop()
+
+                achieved = [fitness(genome, u["wanted"], u["money"]) for u, genome in zip(users, genomes)]
+                gaps = [1 - a / o for a, o in zip(achieved, optimal) if o > 0]
+                result = {
+                    "solver": solver,
+                    "wishlist_length": length,
+                    "pop_size": pop_size,
+                    "generation_limit": generation_limit,
+                    "users": len(users),
+                    "wall_time_s": wall_time,
+                    "peak_memory_mb": peak_memory,
+                    "optimality_gap": 1 - sum(achieved) / sum(optimal) if sum(optimal) else 0,
+                    "mean_user_gap": float(np.mean(gaps)) if gaps else 0,
+                    "max_user_gap": max(gaps) if gaps else 0,
+                }
+                result.update(stats)
+                results.append(result)
+                print(f"{solver} length={length} pop={pop_size} gen={generation_limit}: {wall_time:.3f}s, gap {result['optimality_gap']:.4f}", flush=True)
+    return results
+
+def int_list(value: str) -> list:
+    return [int(v) for v in value.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the knapsack solvers on the bundled user_money_rates/album_price files.")
+    parser.add_argument("--solvers", default=",".join(SOLVERS), help="comma separated solvers (list, array, batched, dp)")
+    parser.add_argument("--populations", type=int_list, default=[10, 100, 300], help="comma separated population sizes")
+    parser.add_argument("--generations", type=int_list, default=[10, 100, 300], help="comma separated generation limits")
+    parser.add_argument("--lengths", type=int_list, default=[10, 50, 200], help="comma separated wishlist lengths")
+    parser.add_argument("--users", type=int, default=None, help="number of users (default all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="do not measure the peak memory (faster)")
+    parser.add_argument("--output", default="benchmark_knapsack.json", help="json file of the results")
+    args = parser.parse_args()
+
+    solvers = args.solvers.split(",")
+    for solver in solvers:
+        if solver not in SOLVERS:
+            parser.error(f"unknown solver: {solver}")
+    results = benchmark(solvers, args.populations, args.generations, args.lengths, args.users, args.seed, not args.no_memory)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}.")
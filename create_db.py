@@ -1,10 +1,21 @@
-import random
 import os
+import sys
+import zlib
+from collections import deque
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain, repeat
+import numpy as np
 import pandas as pd
+import psycopg2
+from scipy import sparse
 from scipy.stats.mstats import winsorize
-import networkx as nx
 import matplotlib.pyplot as plt
 import scraper.scrape as sp
+import latest_prices
+from db_utils import copy_upsert
+from sparse_utils import top_k_per_row
 from Crypto.Cipher import AES
 from dotenv import load_dotenv
 
@@ -138,6 +149,9 @@ def create_tables(conn):
             cursor.execute(command)
         # Commit the changes to the database
         conn.commit()
+        # latest price of every disc (updated on every insert in disc_prices)
+        latest_prices.create_latest_prices(conn)
+        create_indexes(conn)
         # Execute the ALTER TABLE command to add foreign key constraint
         cursor.execute(foreign_keys)
 
@@ -149,35 +163,115 @@ def create_tables(conn):
     except Exception as e:
         print(f"Error: {e}")
 
-def fill_user_wants_discs(conn):
+def create_indexes(conn, dedupe_prices=False):
+    """
+    Creates the indexes of the lookups done by the api, stats and recommendations (case insensitive names,
+    reverse friendships, owners of a disc, fans of a band) and the unique key of the disc prices.
+    Existing indexes are kept, so it can also be run on an existing database.
+
+    Args:
+        conn (object): The database connection object.
+        dedupe_prices (bool, optional): Whether to delete the duplicate (name, band, date) prices first,
+            which would prevent the unique key from being created. Defaults to False.
+
+    Returns:
+        None
+    """
+    create_index_commands = (
+        "CREATE INDEX IF NOT EXISTS bands_lower_name_idx ON Bands (LOWER(name))",
+        "CREATE INDEX IF NOT EXISTS discs_lower_name_idx ON Discs (LOWER(name))",
+        "CREATE INDEX IF NOT EXISTS disc_prices_lower_name_idx ON disc_prices (LOWER(name))",
+        f"CREATE INDEX IF NOT EXISTS {latest_prices.LATEST_PRICES_TABLE}_lower_name_idx ON {latest_prices.LATEST_PRICES_TABLE} (LOWER(name))",
+        "CREATE INDEX IF NOT EXISTS user_friends_friend_username_idx ON User_Friends (friend_username)",
+        "CREATE INDEX IF NOT EXISTS user_has_discs_disc_idx ON user_has_discs (disc_name, disc_band)",
+        "CREATE INDEX IF NOT EXISTS user_has_discs_lower_disc_name_idx ON user_has_discs (LOWER(disc_name))",
+        "CREATE INDEX IF NOT EXISTS user_likes_band_band_name_idx ON user_likes_band (band_name)",
+        "CREATE INDEX IF NOT EXISTS user_likes_band_lower_band_name_idx ON user_likes_band (LOWER(band_name))",
+    )
+    # a database made before the latest price table existed gets it now, so its index can be created.
+    latest_prices.ensure_latest_prices(conn)
+    cursor = conn.cursor()
+    for command in create_index_commands:
+        cursor.execute(command)
+    conn.commit()
+
+    if dedupe_prices:
+        cursor.execute("""
+            DELETE FROM disc_prices a USING disc_prices b
+            WHERE a.ctid > b.ctid AND a.name = b.name AND a.band = b.band AND a.date = b.date
+        """)
+        print(f"Deleted {cursor.rowcount} duplicate prices.")
+    try:
+        # a disc has one price per date.
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS disc_prices_name_band_date_key ON disc_prices (name, band, date)")
+        conn.commit()
+    except psycopg2.IntegrityError:
+        conn.rollback()
+        print("Unique key of disc prices not created: there are duplicate prices (run create_db.py --indexes --dedupe).")
+
+def fill_user_wants_discs(conn, mode="server", seed=None):
     """
     Fills User Wants Discs table with records for each user and their desired discs.
+    Every user wants every disc that is owned by some other user, with a random want level from 1 to 5.
 
     Args:
         conn: The database connection object.
+        mode (str, optional): "server" generates the whole table with one INSERT ... SELECT in the database,
+            "client" generates it with numpy and streams it with COPY. Defaults to "server".
+        seed (int, optional): Seed of the random want levels, for reproducible tables. Defaults to None.
 
     Returns:
         None
     """
     print("Filling User Wants Discs...")
     cur = conn.cursor()
+    # a disc is owned by some other user than u, unless its only owner is u (first and last owner are u).
+    owners = """
+        SELECT disc_name, disc_band, MIN(username) AS first_owner, MAX(username) AS last_owner
+        FROM user_has_discs
+        GROUP BY disc_name, disc_band
+    """
 
-    cur.execute("SELECT username FROM users")
-    users = cur.fetchall()
-    for username in users:
-        cur.execute("select disc_name, disc_band FROM user_has_discs WHERE not username= %s", (username))
+    if mode == "server":
+        if seed is not None:
+            cur.execute("SELECT setseed(%s)", ((seed % 2 ** 31) / 2 ** 31,))
+        cur.execute(f"""
+            INSERT INTO user_wants_discs (username, disc_name, disc_band, want)
+            SELECT users.username, owners.disc_name, owners.disc_band, floor(random() * 5)::int + 1
+            FROM users
+            JOIN ({owners}) owners ON NOT (owners.first_owner = users.username AND owners.last_owner = users.username)
+            ON CONFLICT DO NOTHING
+        """)
+    elif mode == "client":
+        rng = np.random.default_rng(seed)
+        cur.execute("SELECT username FROM users ORDER BY username")
+        users = np.array([row[0] for row in cur.fetchall()], dtype=object)
+        cur.execute(owners + " ORDER BY disc_name, disc_band")
         discs = cur.fetchall()
-        for disc in discs:
-            insert_query = "INSERT INTO user_wants_discs VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING"
-            cur.execute(insert_query, (username, disc[0], disc[1], random.randint(1, 5)))
-        conn.commit()
 
-def load_users(conn):
+        def rows():
+            for name, band, first_owner, last_owner in discs:
+                wanters = users if first_owner != last_owner else users[users != first_owner]
+                yield from zip(wanters, repeat(name), repeat(band), rng.integers(1, 6, size=len(wanters)).tolist())
+
+        copy_upsert(conn, "user_wants_discs", ["username", "disc_name", "disc_band", "want"], rows())
+    else:
+        raise ValueError(f"Unknown user wants mode: {mode}")
+    conn.commit()
+
+# number of csv rows read (validated, encrypted and copied) at a time by load_users.
+USERS_CHUNK_SIZE = 10000
+
+def load_users(conn, chunk_size=USERS_CHUNK_SIZE, workers=1):
     """
     Loads user data from a CSV file into a PostgreSQL database.
+    The file is streamed in chunks of chunk_size rows, so the memory used does not depend on its size.
+    The users are inserted only if all the rows of the file are valid.
 
     Parameters:
         conn (psycopg2.extensions.connection): The connection object to the PostgreSQL database.
+        chunk_size (int, optional): The number of rows read, validated and inserted at a time. Defaults to USERS_CHUNK_SIZE.
+        workers (int, optional): The number of processes that validate and encrypt chunks in parallel. Defaults to 1 (no pool).
 
     Raises:
         ValueError: If the CSV file contains any missing or invalid data.
@@ -185,11 +279,55 @@ def load_users(conn):
     Returns:
         None
     """
-    # Create a cursor object
-    cursor = conn.cursor()
+    load_dotenv()
+    key = os.getenv('SECRET_KEY', '1234567890123456')
+    columns = ["username", "password", "first_name", "last_name", "phone", "gender", "country", "age", "money"]
+    total = 0
+
+    def rows():
+        nonlocal total
+        # Open the CSV file and read the data in chunks
+        chunks = pd.read_csv("users.csv", chunksize=chunk_size)
+        if workers > 1:
+            # at most 2 chunks per worker are waiting, so the file is not read faster than it is inserted.
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                for df in chunks:
+                    pending.append(executor.submit(prepare_users, df, key))
+                    if len(pending) >= 2 * workers:
+                        chunk = pending.popleft().result()
+                        total += len(chunk)
+                        yield from chunk
+                while pending:
+                    chunk = pending.popleft().result()
+                    total += len(chunk)
+                    yield from chunk
+        else:
+            for df in chunks:
+                chunk = prepare_users(df, key)
+                total += len(chunk)
+                yield from chunk
+
+    # all chunks are copied into one staging table and merged into users at the end, so an invalid
+    # row in any chunk raises before any user is inserted (like checking the whole file first).
+    copy_upsert(conn, "users", columns, rows())
+    conn.commit()
+    print(f"Data inserted successfully ({total} rows read).")
+
+def prepare_users(df, key: str) -> list:
+    """
+    Validates a chunk of the users CSV file and encrypts the passwords.
 
-    # Open the CSV file and read the data
-    df = pd.read_csv("users.csv")
+    Parameters:
+        df (DataFrame): The chunk of the users CSV file.
+        key (str): The secret key of the password encryption.
+
+    Raises:
+        ValueError: If the chunk contains any missing or invalid data.
+
+    Returns:
+        list: The rows of the users (username, password, first_name, last_name, phone, gender, country, age, money).
+    """
     if df['username'].isnull().any():
         raise ValueError("Missing username in the CSV file.")
     if df['password'].isnull().any():
@@ -200,18 +338,44 @@ def load_users(conn):
         raise ValueError("Invalid age in the CSV file (user aged over 110 years old).")
     if df['gender'].isin(['N']).any():
         raise ValueError("Invalid gender in the CSV file (should be M or F).")
-    df['gender'].fillna("N", inplace=True)
-    df['money'].fillna(0, inplace=True)
+    df['gender'] = df['gender'].fillna("N")
+    df['money'] = df['money'].fillna(0)
     if not df['gender'].isin(['M', 'F', 'N']).all():
         raise ValueError("Invalid gender in the CSV file (should be M or F).")
-    df['age'].fillna(-1, inplace=True)
-    df.fillna("unregistered", inplace=True)
+    df['age'] = df['age'].fillna(-1).astype(int)
+    df = df.fillna("unregistered")
 
-    cursor.executemany("INSERT INTO users (username, password, first_name, last_name, phone, gender, country, age, money) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING",
-                   [(row['username'], encr(row['password']), row['first_name'], row['last_name'], row['phone'], row['gender'], row['country'], row['age'], row['money']) for index, row in df.iterrows()])
+    passwords = encrypt_passwords(df['password'].astype(str).tolist(), key)
+    return list(zip(df['username'].tolist(), passwords, df['first_name'].tolist(), df['last_name'].tolist(), df['phone'].tolist(),
+                    df['gender'].tolist(), df['country'].tolist(), df['age'].tolist(), df['money'].tolist()))
 
-    conn.commit()
-    print("Data inserted successfully.")
+def encrypt_passwords(passwords: list, key: str) -> list:
+    """
+    Encrypts many passwords with one cipher, like encr.
+
+    Parameters:
+        passwords (list): The passwords to be encrypted.
+        key (str): The secret key.
+
+    Returns:
+        list: The encrypted passwords, as stored in the database ('\\x' and the hex of the bytes).
+    """
+    cipher = AES.new(key.encode('utf-8'), AES.MODE_ECB)
+    padded = [password.rjust(32).encode() for password in passwords]
+    if all(len(p) == 32 for p in padded):
+        # every block is encrypted independently in ECB, so all passwords are encrypted at once.
+        encrypted = cipher.encrypt(b"".join(padded)).hex()
+        return ["\\x" + encrypted[i:i + 64] for i in range(0, len(encrypted), 64)]
+    return ["\\x" + cipher.encrypt(p).hex() for p in padded]
+
+@lru_cache(maxsize=1)
+def password_cipher():
+    """
+    Returns the cipher of the passwords (created only the first time it is called).
+    """
+    load_dotenv()
+    key = os.getenv('SECRET_KEY', '1234567890123456').encode('utf-8')
+    return AES.new(key, AES.MODE_ECB)
 
 def encr(password):
     """
@@ -226,21 +390,20 @@ def encr(password):
     Raises:
         None
     """
-    load_dotenv()
-    key = os.getenv('SECRET_KEY', '1234567890123456').encode('utf-8')
     # Input string to be encrypted (padding to adjust length)
     input_string = password.rjust(32)
     # Encrypt the string
-    cipher = AES.new(key)
-    return cipher.encrypt(input_string.encode())
+    return password_cipher().encrypt(input_string.encode())
 
-def load_prices_webscrape(conn, MAX_DISCS=-1):
+def load_prices_webscrape(conn, MAX_DISCS=-1, workers=1):
     """
     Loads disc prices from Discogs using web scraping and inserts them into the database.
+    The discs are scraped by a pool of workers browsers, which are started once and reused for all discs.
 
     Parameters:
         conn (object): The database connection object.
         MAX_DISCS (int): The maximum number of discs to load prices for. Defaults to -1, which means no limit.
+        workers (int, optional): The number of discs scraped at the same time (one browser each). Defaults to 1.
 
     Returns:
         None
@@ -251,33 +414,50 @@ def load_prices_webscrape(conn, MAX_DISCS=-1):
     cursor = conn.cursor()
     cursor.execute("SELECT band_id,discs.band,discs.name FROM discs JOIN bands ON discs.band=bands.name")
     rows = cursor.fetchall()
-    count = 0
-    for row in rows:
-        if MAX_DISCS > 0 and count >= MAX_DISCS:
-            break
-        count += 1
-        band_id, band_name, disc_name = row
-        d = sp.load_prices_discogs(band_id, disc_name)
-        # define the query to insert the dictionary into the database table
-        # print(d)
-        if not d.empty and d.size >= 7: # if d.size < 7 then we are adding the synthetic data
-            # define the query to insert the dataframe into the database table
-            insert_query = "INSERT INTO disc_prices (name, values, band, date) VALUES (%s, %s, %s, %s)"
-            # iterate over the dataframe and insert each row into the database
-            for index, row in d.iterrows():
-                cursor.execute(insert_query, (disc_name, row["lowest_price"], band_name, index.date()))
-        else:
-            print("Loading synthetic data...")
-            load_prices(conn,disc_name,band_name)
-
-def load_prices(conn,name_of_disc:str = None, band_of_disk:str= None):
+    if MAX_DISCS > 0:
+        rows = rows[:MAX_DISCS]
+
+    start = time.perf_counter()
+    with sp.DriverPool(workers) as pool:
+        def scrape(row):
+            band_id, band_name, disc_name = row
+            try:
+                with pool.driver() as driver:
+                    return sp.load_prices_discogs(band_id, disc_name, driver=driver)
+            except Exception as e:
+                # a disc that fails gets the synthetic prices (like a disc that is not for sale).
+                print(f"Failed to scrape disc {disc_name} ({band_name}): {type(e).__name__}: {e}")
+                return pd.DataFrame()
+
+        # the discs are scraped in threads and inserted here, in order.
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for count, (row, d) in enumerate(zip(rows, executor.map(scrape, rows)), 1):
+                band_id, band_name, disc_name = row
+                # define the query to insert the dictionary into the database table
+                # print(d)
+                if not d.empty and d.size >= 7: # if d.size < 7 then we are adding the synthetic data
+                    # define the query to insert the dataframe into the database table
+                    insert_query = "INSERT INTO disc_prices (name, values, band, date) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING"
+                    # iterate over the dataframe and insert each row into the database
+                    for index, price in d.iterrows():
+                        cursor.execute(insert_query, (disc_name, price["lowest_price"], band_name, index.date()))
+                else:
+                    print("Loading synthetic data...")
+                    load_prices(conn,disc_name,band_name)
+                minutes = (time.perf_counter() - start) / 60
+                print(f"Scraped {count}/{len(rows)} discs ({count / minutes if minutes else 0:.1f} discs/minute).")
+
+def load_prices(conn,name_of_disc:str = None, band_of_disk:str= None, seed=None, jitter=0.0, offset=0.0):
     """
-    Loads disc prices into the database.
+    Loads disc prices into the database. The prices of all discs are sent with one COPY.
 
     Parameters:
         conn (object): The database connection object.
         name_of_disc (str): The name of the disc to load prices for. Defaults to None.
         band_of_disk (str): The band associated with the disc. Defaults to None.
+        seed (int, optional): Seed of the per disc variation of the series. Defaults to None.
+        jitter (float, optional): The relative noise added to every price of a disc. Defaults to 0 (no noise).
+        offset (float, optional): The max relative shift of the whole series of a disc. Defaults to 0 (no shift).
 
     Returns:
         None
@@ -294,30 +474,21 @@ def load_prices(conn,name_of_disc:str = None, band_of_disk:str= None):
         cursor.execute("SELECT * FROM discs WHERE name = %s AND band = %s", (name_of_disc, band_of_disk))
         disc = cursor.fetchone()
         if disc:
-            prices_insertion(conn,cursor,df,name_of_disc,band_of_disk)
+            prices_insertion(conn,cursor,df,name_of_disc,band_of_disk,seed,jitter,offset)
             return
 
-    for disc in discs:
-        name, band = disc
-        prices_insertion(conn,cursor,df,name,band)
-    
+    rows = chain.from_iterable(price_rows(name, band, seed, jitter, offset) for name, band in discs)
+    copy_upsert(conn, "disc_prices", ["date", "values", "name", "band"], rows)
+    conn.commit()
+    print(f"Prices for {len(discs)} discs inserted successfully.")
 
-def prices_insertion(conn,cursor,df,name,band):
+@lru_cache(maxsize=1)
+def base_price_series() -> tuple:
     """
-    Inserts disc prices into the database.
-
-    Parameters:
-        conn (object): The database connection object.
-        cursor (object): The database cursor object.
-        df (DataFrame): The DataFrame containing the disc prices.
-        name (str): The name of the disc.
-        band (str): The band associated with the disc.
+    Reads and cleans the synthetic price series of File_series.csv (only the first time it is called).
 
     Returns:
-        None
-
-    Raises:
-        None
+        tuple: The dates (datetime.date) and the prices of the series (read only numpy arrays).
     """
     df = pd.read_csv("File_series.csv")
     df['date'] = pd.to_datetime(df['date'])
@@ -342,18 +513,105 @@ def prices_insertion(conn,cursor,df,name,band):
     for col in df.columns:
         if col != "date":
             df[col] = winsorize(df[col], limits=(0.01, 0.02))
-    for row in df.itertuples(index=False):
-        cursor.execute("INSERT INTO disc_prices (date, values, name, band) VALUES (%s, %s, %s, %s)", (row.date, row.values, name, band))
+
+    dates = df['date'].dt.date.to_numpy()
+    values = df['values'].to_numpy(dtype=float)
+    dates.flags.writeable = False
+    values.flags.writeable = False
+    return dates, values
+
+def price_rows(name, band, seed=None, jitter=0.0, offset=0.0):
+    """
+    Generates the synthetic price rows of a disc from the base series. With jitter or offset, the series of
+    every disc is different (and reproducible with a seed, whatever other discs are generated).
+
+    Parameters:
+        name (str): The name of the disc.
+        band (str): The band associated with the disc.
+        seed (int, optional): Seed of the variation of the series. Defaults to None.
+        jitter (float, optional): The relative noise added to every price. Defaults to 0 (no noise).
+        offset (float, optional): The max relative shift of the whole series. Defaults to 0 (no shift).
+
+    Returns:
+        iterator: The (date, price, name, band) rows of the disc.
+    """
+    dates, values = base_price_series()
+    if jitter or offset:
+        rng = np.random.default_rng(None if seed is None else [seed, zlib.crc32(f"{name}\0{band}".encode())])
+        shift = 1 + rng.uniform(-offset, offset)
+        values = np.maximum(values * shift * (1 + jitter * rng.standard_normal(len(values))), 0)
+    return zip(dates, values.tolist(), repeat(name), repeat(band))
+
+def prices_insertion(conn,cursor,df,name,band,seed=None,jitter=0.0,offset=0.0):
+    """
+    Inserts disc prices into the database.
+
+    Parameters:
+        conn (object): The database connection object.
+        cursor (object): The database cursor object.
+        df (DataFrame): The DataFrame containing the disc prices.
+        name (str): The name of the disc.
+        band (str): The band associated with the disc.
+        seed (int, optional): Seed of the variation of the series. Defaults to None.
+        jitter (float, optional): The relative noise added to every price. Defaults to 0 (no noise).
+        offset (float, optional): The max relative shift of the whole series. Defaults to 0 (no shift).
+
+    Returns:
+        None
+
+    Raises:
+        None
+    """
+    copy_upsert(conn, "disc_prices", ["date", "values", "name", "band"], price_rows(name, band, seed, jitter, offset))
     conn.commit()
     print(f"Prices for disc {name} of band {band} inserted successfully.")
 
 
-def insert_user_has_disc(conn):
+# max number of (user, item) cells of a random mask drawn at once by sample_user_pairs.
+PAIRS_CHUNK_CELLS = 10_000_000
+
+def sample_user_pairs(num_users, num_items, rng, density=None) -> tuple:
+    """
+    Draws random (user, item) pairs. Without a density, every user draws 0 to 5 items (with replacement)
+    and the duplicate pairs are removed. With a density, every pair is kept with probability density,
+    so each user gets that fraction of the items on average.
+
+    Parameters:
+        num_users (int): The number of users.
+        num_items (int): The number of items.
+        rng (np.random.Generator): The random generator.
+        density (float, optional): The expected fraction of the items of each user.
+            Defaults to None, which draws 0 to 5 items per user.
+
+    Returns:
+        tuple: The user indexes and the item indexes of the unique pairs (numpy arrays).
+    """
+    if num_users == 0 or num_items == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    if density is not None:
+        # the (users x items) mask is drawn in chunks of users, so memory stays bounded.
+        chunk = max(1, PAIRS_CHUNK_CELLS // num_items)
+        users, items = [], []
+        for first in range(0, num_users, chunk):
+            u, i = np.nonzero(rng.random((min(chunk, num_users - first), num_items)) < density)
+            users.append(u + first)
+            items.append(i)
+        return np.concatenate(users).astype(np.int64), np.concatenate(items).astype(np.int64)
+    counts = rng.integers(0, 6, size=num_users)
+    users = np.repeat(np.arange(num_users, dtype=np.int64), counts)
+    items = rng.integers(num_items, size=len(users))
+    # every pair is packed in one integer, so np.unique removes the duplicates (and sorts them by user).
+    return np.divmod(np.unique(users * num_items + items), num_items)
+
+def insert_user_has_disc(conn, seed=None, density=None):
     """
     Inserts random disc ownerships for each user into the database.
 
     Parameters:
         conn (object): The database connection object.
+        seed (int, optional): Seed of the random ownerships, for reproducible tables. Defaults to None.
+        density (float, optional): The expected fraction of all discs owned by each user.
+            Defaults to None (0 to 5 discs per user).
 
     Returns:
         None
@@ -364,29 +622,31 @@ def insert_user_has_disc(conn):
     cur = conn.cursor()
 
     # Select all usernames from the users table
-    cur.execute("SELECT username FROM users")
-    users = cur.fetchall()
+    cur.execute("SELECT username FROM users ORDER BY username")
+    users = np.array([row[0] for row in cur.fetchall()], dtype=object)
 
     # Select all disc names and band names from the discs table
-    cur.execute("SELECT name, band FROM discs")
+    cur.execute("SELECT name, band FROM discs ORDER BY name, band")
     discs = cur.fetchall()
+    names = np.array([disc[0] for disc in discs], dtype=object)
+    bands = np.array([disc[1] for disc in discs], dtype=object)
 
     # Insert random disc ownerships for each user
-    for user in users:
-        for i in range(random.randint(0, 5)):
-            disc = random.choice(discs)
-            insert_query = "INSERT INTO user_has_discs VALUES (%s, %s, %s) ON CONFLICT DO NOTHING"
-            cur.execute(insert_query, (user[0], disc[0], disc[1]))
+    u, d = sample_user_pairs(len(users), len(discs), np.random.default_rng(seed), density)
+    copy_upsert(conn, "user_has_discs", ["username", "disc_name", "disc_band"], zip(users[u], names[d], bands[d]))
     print("Initialized relation user-has-disc.")
     conn.commit()
 
 
-def insert_user_likes_band(conn):
+def insert_user_likes_band(conn, seed=None, density=None):
     """
     Inserts random band preferences for each user into the database.
 
     Parameters:
         conn (object): The database connection object.
+        seed (int, optional): Seed of the random preferences, for reproducible tables. Defaults to None.
+        density (float, optional): The expected fraction of all bands liked by each user.
+            Defaults to None (0 to 5 bands per user).
 
     Returns:
         None
@@ -397,85 +657,199 @@ def insert_user_likes_band(conn):
     cur = conn.cursor()
 
     # Select all usernames from the users table
-    cur.execute("SELECT username FROM users")
-    users = cur.fetchall()
+    cur.execute("SELECT username FROM users ORDER BY username")
+    users = np.array([row[0] for row in cur.fetchall()], dtype=object)
 
-    # Select all disc names and band names from the discs table
-    cur.execute("SELECT name FROM bands")
-    bands = cur.fetchall()
-
-    # Insert random disc preferences for each user
-    for user in users:
-        for i in range(random.randint(0, 5)):
-            band = random.choice(bands)
-            insert_query = f"INSERT INTO user_likes_band VALUES ('{user[0]}', '{band[0]}') ON CONFLICT DO NOTHING"
-            cur.execute(insert_query)
+    # Select all band names from the bands table
+    cur.execute("SELECT name FROM bands ORDER BY name")
+    bands = np.array([row[0] for row in cur.fetchall()], dtype=object)
+
+    # Insert random band preferences for each user
+    u, b = sample_user_pairs(len(users), len(bands), np.random.default_rng(seed), density)
+    copy_upsert(conn, "user_likes_band", ["username", "band_name"], zip(users[u], bands[b]))
     print("Initialized relation user-likes-band.")
     conn.commit()
 
-def fill_barabasi_model(conn, m=3):
+def cap_fanout(adjacency, max_fanout, seed=None):
     """
-    Define the parameters of the Barabási-Albert model.
-    Parameters: m -> number of edges to attach from a new node to existing nodes
+    Keeps at most max_fanout friends in every row of a friendship matrix, chosen uniformly at random
+    (not by id: the oldest users of a Barabási-Albert graph have the smallest ids and are the hubs,
+    so keeping the smallest ids would follow the same few hubs from everyone).
+
+    Args:
+        adjacency (scipy.sparse.csr_matrix): The (users x users) friendship matrix.
+        max_fanout (int): The max number of friends of every user (None for no limit).
+        seed (int, optional): Seed of the random choice of the friends, for reproducible results. Defaults to None.
+
+    Returns:
+        scipy.sparse.csr_matrix: The capped friendship matrix.
     """
-    # Get the usernames from the database and saves them to a list.
-    query = """
-        SELECT Users.username, user_has_discs.disc_name, user_has_discs.disc_band FROM Users
-        LEFT JOIN user_has_discs ON Users.username=user_has_discs.username
+    adjacency = adjacency.tocsr()
+    adjacency.sort_indices()
+    if not max_fanout:
+        return adjacency
+    rows = np.repeat(np.arange(adjacency.shape[0]), np.diff(adjacency.indptr))
+    # every friend gets a random key; the max_fanout friends with the smallest keys of every row are kept.
+    order = np.lexsort((np.random.default_rng(seed).random(adjacency.nnz), rows))
+    keep = np.zeros(adjacency.nnz, dtype=bool)
+    keep[order[np.arange(adjacency.nnz) - adjacency.indptr[rows] < max_fanout]] = True
+    return sparse.csr_matrix((adjacency.data[keep], (rows[keep], adjacency.indices[keep])), shape=adjacency.shape)
+
+def neighbor_disc_recommendations(adjacency, ownership, k, hops=1, hop_weights=(1.0, 0.5), max_fanout=None, seed=None) -> tuple:
     """
-    df = pd.read_sql(query, conn)
-    usernames = df['username'].unique()
-    # print(df['username'])
+    Recommends to every user the k discs with the highest score among the discs they do not own. The score of a disc
+    is the number of friends owning it (times hop_weights[0]), plus with hops=2 the number of friends of friends
+    (users at distance 2) owning it (times hop_weights[1]). Ties are broken by the disc id (the smallest id first).
 
-    n = len(usernames)
-    # print(n)
-    community_graph = nx.barabasi_albert_graph(n, m)
-
-    G = nx.Graph()
-    edges = [(usernames[e[0]], usernames[e[1]]) for e in community_graph.edges]
-    G.add_edges_from(edges)
-    # nx.draw(G, with_labels=True)
-    # plt.show()
-
-    with conn.cursor() as cur:
-        for friends in G.edges:
-            cur.execute("INSERT INTO User_Friends (username, friend_username) VALUES (%s, %s)", (friends[0], friends[1]))
-        conn.commit()
-    print("Filled User-Friends Table according to Barabasi Model.")
+    Args:
+        adjacency (scipy.sparse.csr_matrix): The (users x users) friendship matrix (1 for friends).
+        ownership (scipy.sparse.csr_matrix): The (users x discs) ownership matrix (1 for owned discs).
+        k (int): The number of discs recommended to each user.
+        hops (int, optional): 1 to recommend from friends, 2 to also recommend from friends of friends. Defaults to 1.
+        hop_weights (tuple, optional): The weight of a friend and of a friend of a friend. Defaults to (1.0, 0.5).
+        max_fanout (int, optional): The max number of friends of every user followed to find friends of friends,
+            which bounds the work of users with very many friends. The followed friends are chosen at random. Defaults to None (no limit).
+        seed (int, optional): Seed of the random choice of the followed friends. Defaults to None.
 
-    # adding discs feature:
-    for user in G.nodes:
-        node_data = df[df['username'] == user]
-        discs = node_data['disc_name'].tolist()
-        bands = node_data['disc_band'].tolist()
-        G.nodes[user]['discs'] = list(zip(discs, bands))
+    Returns:
+        tuple: The user ids, the disc ids and the score, of every recommendation (numpy arrays).
+    """
+    # number of friends of every user owning every disc, for all users at once.
+    scores = hop_weights[0] * (adjacency @ ownership)
+    if hops == 2:
+        # friends of friends: the users reached in 2 steps, without the user and their friends.
+        capped = cap_fanout(adjacency, max_fanout, seed)
+        second = (capped @ capped).tocsr()
+        second.data[:] = 1
+        second = (second - second.multiply(adjacency) - sparse.diags(second.diagonal())).tocsr()
+        second.eliminate_zeros()
+        scores = scores + hop_weights[1] * (second @ ownership)
+    elif hops != 1:
+        raise ValueError(f"Unsupported number of hops: {hops}")
+    scores = sparse.csr_matrix(scores)
+    scores = scores - scores.multiply(ownership)   # only the discs that the user does not have.
+    return top_k_per_row(scores, k)
+
+def recommend_friend_discs(conn, hops=1, hop_weights=(1.0, 0.5), max_fanout=None, seed=None):
+    """
+    Recommends discs to every user from the discs of their friends (see neighbor_disc_recommendations),
+    using the friendships of the User_Friends table, and replaces the user_rec_discs table.
 
+    Args:
+        conn: The database connection object.
+        hops (int, optional): 1 to recommend from friends, 2 to also recommend from friends of friends. Defaults to 1.
+        hop_weights (tuple, optional): The weight of a friend and of a friend of a friend. Defaults to (1.0, 0.5).
+        max_fanout (int, optional): The max number of friends of every user followed to find friends of friends. Defaults to None.
+        seed (int, optional): Seed of the random choice of the followed friends. Defaults to None.
+
+    Returns:
+        None
+    """
     load_dotenv()
     print("Recommending discs...")
-    for user in G.nodes:
-        d = {}
-        neighbors = list(G.adj[user].keys())
-        # print((user, d))
-        for n in neighbors:
-            discs = G.nodes[n]['discs']
-            for disc in discs:
-                if disc[0] and disc not in d and disc not in G.nodes[user]['discs']:
-                    # print(disc, G.nodes[user]['discs'])
-                    d[disc] = 1
-                elif disc[0] and disc not in G.nodes[user]['discs']: # recommends only the discs that the user does not have.
-                    # print(disc, G.nodes[user]['discs'])
-                    d[disc] += 1
-        sorted_list = sorted(d.items(), key=lambda x: x[1], reverse=True)
-        # print(user, sorted_list)
-        rec_discs = int(os.getenv("NUMBER_REC_DISCS", 1))
-        insert_query = "INSERT INTO user_rec_discs (username, disc_name, disc_band) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING"
-        with conn.cursor() as cur:
-            for d in sorted_list[:rec_discs]: # gets the top rec_discs+1 dics.
-                cur.execute(insert_query, (user, d[0][0], d[0][1]))
-        conn.commit()
+    rec_discs = int(os.getenv("NUMBER_REC_DISCS", 1))
+    friends = pd.read_sql("SELECT username, friend_username FROM User_Friends", conn)
+    owned = pd.read_sql("SELECT username, disc_name, disc_band FROM user_has_discs", conn)
+    usernames = pd.Index(pd.read_sql("SELECT username FROM users ORDER BY username", conn)['username'])
+    n = len(usernames)
+
+    # users and discs get integer ids (discs sorted by name and band).
+    first, second = usernames.get_indexer(friends['username']), usernames.get_indexer(friends['friend_username'])
+    adjacency = sparse.csr_matrix((np.ones(2 * len(friends)), (np.concatenate((first, second)), np.concatenate((second, first)))),
+                                  shape=(n, n))
+    adjacency.data[:] = 1   # friends connected in both directions count once.
+    disc_ids, discs = pd.factorize(pd.MultiIndex.from_arrays([owned['disc_name'], owned['disc_band']]), sort=True)
+    ownership = sparse.csr_matrix((np.ones(len(owned)), (usernames.get_indexer(owned['username']), disc_ids)), shape=(n, len(discs)))
+
+    users, rec, _ = neighbor_disc_recommendations(adjacency, ownership, rec_discs, hops, hop_weights, max_fanout, seed)
+    recommendations = zip(usernames[users], discs.get_level_values(0)[rec], discs.get_level_values(1)[rec])
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM user_rec_discs")
+    copy_upsert(conn, "user_rec_discs", ["username", "disc_name", "disc_band"], recommendations)
+    conn.commit()
     print("Discs recommended.")
 
+def barabasi_albert_edges(n, m, seed=None) -> tuple:
+    """
+    Generates a Barabási-Albert (preferential attachment) graph with the Batagelj-Brandes method:
+    the graph starts as a star of m+1 nodes and every next node is connected to m nodes, chosen with
+    probability proportional to their degree (by copying the endpoint of a random earlier edge).
+    All random choices are drawn at once and resolved with pointer jumping. Duplicate edges are dropped,
+    so a few nodes may get less than m edges.
+
+    Args:
+        n (int): The number of nodes.
+        m (int): The number of edges to attach from a new node to existing nodes.
+        seed (int, optional): Seed of the random generator, for reproducible graphs. Defaults to None.
+
+    Returns:
+        tuple: The first and the second node of every edge (numpy arrays).
+
+    Raises:
+        ValueError: If m is not between 1 and n - 1.
+    """
+    if m < 1 or m >= n:
+        raise ValueError(f"Barabási-Albert network must have m >= 1 and m < n, m = {m}, n = {n}")
+    rng = np.random.default_rng(seed)
+    num_edges = m + (n - m - 1) * m
+    # edge e connects source[e] and target[e]; the first m edges are the star around node 0.
+    source = np.concatenate((np.arange(1, m + 1), np.repeat(np.arange(m + 1, n), m)))
+    target = np.zeros(num_edges, dtype=np.int64)
+    first_edge = np.concatenate((np.zeros(m, dtype=np.int64), m + (source[m:] - m - 1) * m))   # first edge of the source node.
+
+    # every new edge copies one of the 2 endpoints of a random edge added before its source node.
+    endpoint = rng.integers(0, 2 * first_edge[m:])
+    pointer = np.arange(num_edges)
+    pointer[m:] = endpoint // 2
+    known = np.ones(num_edges, dtype=bool)
+    copies_source = endpoint % 2 == 0
+    target[m:][copies_source] = source[pointer[m:][copies_source]]
+    known[m:] = copies_source
+
+    # the other edges copy the target of an earlier edge: follows (and shortens) the pointers until a known target.
+    unknown = np.flatnonzero(~known)
+    while len(unknown):
+        p = pointer[unknown]
+        found = known[p]
+        target[unknown[found]] = target[p[found]]
+        known[unknown[found]] = True
+        unknown = unknown[~found]
+        pointer[unknown] = pointer[pointer[unknown]]
+
+    edges = np.unique(np.minimum(source, target) * n + np.maximum(source, target))
+    return np.divmod(edges, n)
+
+def fill_barabasi_model(conn, m=3, hops=1, hop_weights=(1.0, 0.5), max_fanout=None, seed=None):
+    """
+    Define the parameters of the Barabási-Albert model.
+    Parameters: m -> number of edges to attach from a new node to existing nodes
+    hops, hop_weights, max_fanout -> options of the disc recommendations (see recommend_friend_discs)
+    seed -> seed of the random graph (and of the friends followed with max_fanout)
+    """
+    # Get the usernames from the database and saves them to a list.
+    usernames = pd.read_sql("SELECT username FROM Users ORDER BY username", conn)['username'].to_numpy()
+
+    first, second = barabasi_albert_edges(len(usernames), m, seed)
+    copy_upsert(conn, "User_Friends", ["username", "friend_username"], zip(usernames[first], usernames[second]))
+    conn.commit()
+    print("Filled User-Friends Table according to Barabasi Model.")
+
+    recommend_friend_discs(conn, hops, hop_weights, max_fanout, seed)
+
 if __name__ == "__main__":
+    if "--indexes" in sys.argv:
+        # creates the indexes of an existing database.
+        load_dotenv()
+        conn = psycopg2.connect(
+            host=os.getenv("PSQL_HOST"),
+            database=os.getenv("PSQL_DATABASE"),
+            user=os.getenv("PSQL_USERNAME"),
+            password=os.getenv("PSQL_PASSWORD")
+        )
+        create_indexes(conn, dedupe_prices="--dedupe" in sys.argv)
+        conn.close()
+        print("Indexes created.")
+        sys.exit()
     print("This file is not executable and contains methods used in load_api.py. To run the project, run the load_api.py file.")
     # conn = psycopg2.connect(
     #     host=os.getenv("PSQL_HOST"),
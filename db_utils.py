@@ -0,0 +1,57 @@
+import csv
+import io
+import os
+import time
+from itertools import islice
+
+# default number of rows sent to the database per COPY (can be changed with COPY_BATCH_SIZE in .env).
+COPY_BATCH_SIZE = 10000
+
+def copy_upsert(conn, table: str, columns: list, rows, conflict: str = "ON CONFLICT DO NOTHING", batch_size: int = None) -> int:
+    """
+    Writes many rows to a table at once: the rows are streamed with COPY (batch_size rows at a time)
+    into a temporary staging table, which is then merged into the table with a single INSERT ... SELECT.
+    The transaction is not committed, so the caller can commit it together with other changes.
+
+    Args:
+        conn (object): The database connection object.
+        table (str): The name of the table.
+        columns (list): The columns of the rows.
+        rows (iterable): The rows (tuples of values in the order of the columns, None for NULL).
+        conflict (str, optional): The conflict clause of the merge. Rows that are duplicated in the input
+            should only be merged with DO NOTHING. Defaults to "ON CONFLICT DO NOTHING".
+        batch_size (int, optional): The number of rows sent per COPY. Defaults to None (COPY_BATCH_SIZE env variable or 10000).
+
+    Returns:
+        int: The number of rows inserted (or updated) in the table.
+    """
+    if batch_size is None:
+        batch_size = int(os.getenv("COPY_BATCH_SIZE", COPY_BATCH_SIZE))
+    cols = ", ".join(columns)
+    # always in the temporary schema, so a permanent table with the same name is never dropped.
+    staging = f"pg_temp.{table}_staging"
+    start = time.perf_counter()
+    cursor = conn.cursor()
+    # the staging table has only the given columns and no constraints.
+    cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+    cursor.execute(f"CREATE TEMP TABLE {staging} AS SELECT {cols} FROM {table} WITH NO DATA")
+
+    total = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv)", buffer)
+        total += len(batch)
+
+    cursor.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {staging} {conflict}")
+    written = cursor.rowcount
+    cursor.execute(f"DROP TABLE {staging}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {written} of {total} rows to {table} in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} rows/s).")
+    return written
@@ -1,9 +1,18 @@
-from random import choices, randint, randrange, random, sample
+from random import choices, randint, randrange, random, sample, seed as seed_random
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from collections import OrderedDict
+import hashlib
+import time
+import zlib
 import os
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
 import warnings
 import psycopg2
+from latest_prices import LATEST_PRICES_TABLE, ensure_latest_prices
+from db_utils import copy_upsert
 
 warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy connectable")
 
@@ -69,7 +78,54 @@ def fitness(genome: list, things: list, price_limit: int) -> int:
     # print(genome, want)
     return want
 
-def selection_pair(population, things, price_limit) -> list:
+class FitnessCache:
+    """
+    Bounded (least recently used) cache of the fitness values of the genomes of one run,
+    keyed by the genome packed in an integer bitmask.
+
+    Attributes:
+        hits (int): The number of fitness values found in the cache.
+        misses (int): The number of fitness values that had to be calculated.
+    """
+
+    def __init__(self, things: list, price_limit, maxsize: int = 4096):
+        """
+        Args:
+            things (list): The list of things (discs) with their attributes.
+            price_limit (int): The maximum price limit.
+            maxsize (int, optional): The max number of cached genomes (0 disables caching). Defaults to 4096.
+        """
+        self.things = things
+        self.price_limit = price_limit
+        self.maxsize = maxsize
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def fitness(self, genome: list) -> int:
+        """
+        Returns the fitness value of a genome, calculating it only if it is not cached.
+
+        Args:
+            genome (list): The genome to evaluate.
+
+        Returns:
+            int: The fitness value of the genome.
+        """
+        key = int("".join(map(str, genome)) or "0", 2)
+        if key in self.values:
+            self.hits += 1
+            self.values.move_to_end(key)
+            return self.values[key]
+        self.misses += 1
+        value = fitness(genome, self.things, self.price_limit)
+        if self.maxsize > 0:
+            self.values[key] = value
+            if len(self.values) > self.maxsize:
+                self.values.popitem(last=False)   # evicts the least recently used genome.
+        return value
+
+def selection_pair(population, things, price_limit, weights=None) -> list:
     """
     Selects a pair of genomes from the population based on their fitness values.
 
@@ -77,12 +133,14 @@ def selection_pair(population, things, price_limit) -> list:
         population (list): The population of genomes.
         things (list): The list of things (discs) with their attributes.
         price_limit (int): The maximum price limit.
+        weights (list, optional): The fitness values of the population, if already calculated. Defaults to None.
 
     Returns:
         list: A pair of selected genomes.
     """
     # returns the pair of the generation -> we import choices because it is not necessarily the most strong pair (but is higly likely with the weights)
-    weights = [fitness(genome, things, price_limit) for genome in population]
+    if weights is None:
+        weights = [fitness(genome, things, price_limit) for genome in population]
     if all(weight == 0 for weight in weights):
         return sample(population, k=2)
     return choices(
@@ -131,7 +189,8 @@ def mutation(genome: list, num: int = 1, probability: float = 0.5):
     return genome
 
 
-def run_evolution(pop_size, genome_length, things, price_limit, generation_limit) -> list:
+def run_evolution(pop_size, genome_length, things, price_limit, generation_limit, cache=None,
+                  stall_generations=None, time_limit=None, return_generations=False) -> list:
     """
     Performs evolutionary optimization using a genetic algorithm to solve a problem.
 
@@ -141,25 +200,45 @@ def run_evolution(pop_size, genome_length, things, price_limit, generation_limit
         things (list): A list of items or elements to be optimized. The specific representation and format of the items depend on the problem being solved.
         price_limit (float): A constraint or limit to be considered during optimization. The interpretation of the constraint depends on the problem being solved.
         generation_limit (int): The number of generations to evolve.
+        cache (FitnessCache, optional): The fitness cache of the run (its hits/misses can be read afterwards).
+            Defaults to None, which creates a new cache.
+        stall_generations (int, optional): Stops early if the best fitness did not improve for this number of generations. Defaults to None.
+        time_limit (float, optional): Stops early after this number of seconds. Defaults to None.
+        return_generations (bool, optional): Whether to also return the number of generations evolved. Defaults to False.
 
     Returns:
-        list: The best genome obtained after evolving for the specified number of generations.
+        list: The best genome obtained after evolving for the specified number of generations
+            (and the number of generations evolved, if return_generations is True).
     """
+    if cache is None:
+        cache = FitnessCache(things, price_limit)
+    start = time.perf_counter()
+    best_fitness, stalled_for = None, 0
     # create the population
     population = generate_population(pop_size, genome_length)
     # itterate throuth the number of generations:
-    for i in range(generation_limit):
-        population = sorted(
-            population,
-            key=lambda genome: fitness(genome, things, price_limit),
-            reverse=True
-        )
+    i = generation_limit
+    for generation in range(generation_limit):
+        # the fitness of each genome is calculated once per generation and reused by the selection.
+        weights = [cache.fitness(genome) for genome in population]
+        order = sorted(range(len(population)), key=lambda k: weights[k], reverse=True)
+        population = [population[k] for k in order]
+        weights = [weights[k] for k in order]
+
+        # stops if the population converged or the time is over.
+        if best_fitness is None or weights[0] > best_fitness:
+            best_fitness, stalled_for = weights[0], 0
+        else:
+            stalled_for += 1
+        if (stall_generations and stalled_for >= stall_generations) or (time_limit and time.perf_counter() - start >= time_limit):
+            i = generation
+            break
 
         next_generation = population[0:2]   # keeps the top 2 solutions for next gen (elytism).
 
         for j in range(int(len(population) / 2) - 1):   # does this for all the number of remaining pairs:
             # print(population, things, price_limit)
-            parents = selection_pair(population, things, price_limit)
+            parents = selection_pair(population, things, price_limit, weights)
             child_a, child_b = crossover(parents[0], parents[1])
             child_a = mutation(child_a)
             child_b = mutation(child_b)
@@ -168,85 +247,695 @@ def run_evolution(pop_size, genome_length, things, price_limit, generation_limit
         population = next_generation
 
     # returns the best population (of next generations) + the i generation we are at.
-    population = sorted(
-        population,
-        key=lambda genome: fitness(genome, things, price_limit),
-        reverse=True
-    )
-    # return population, i
+    population = sorted(population, key=cache.fitness, reverse=True)
+    if return_generations:
+        return population[0], i
     return population[0]    # returns the best genome.
 
-def genetic_knapshack(conn, pop_size, generation_limit):
+class Wishlist:
     """
-    Performs a genetic algorithm-based optimization to find the best combination of discs that users can buy given their budget constraints.
+    The wanted discs of a user as numpy arrays (slices of the columns returned by load_user_wants, not copies).
+    It can be used everywhere a list of things is expected: indexing and iterating give the
+    things as dictionaries with their name, band, want level and price.
+
+    Attributes:
+        names (np.ndarray): The names of the discs.
+        bands (np.ndarray): The bands of the discs.
+        wants (np.ndarray): The want levels of the discs.
+        prices (np.ndarray): The latest prices of the discs.
+    """
+
+    def __init__(self, names: np.ndarray, bands: np.ndarray, wants: np.ndarray, prices: np.ndarray):
+        self.names = names
+        self.bands = bands
+        self.wants = wants
+        self.prices = prices
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, i: int) -> dict:
+        return {"name": self.names[i], "band": self.bands[i], "want": self.wants[i], "price": self.prices[i]}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+def genome_discs(things, genome=None) -> list:
+    """
+    Returns the (disc name, disc band) of the things selected by a genome.
 
     Args:
-        conn: The database connection object.
+        things (list): The list of things (discs) with their attributes (or a Wishlist).
+        genome (list, optional): The genome of the selected things. Defaults to None (all things).
+
+    Returns:
+        list: The (disc name, disc band) of the selected things.
+    """
+    if isinstance(things, Wishlist):
+        if genome is None:
+            return list(zip(things.names, things.bands))
+        selected = np.asarray(genome, dtype=bool)
+        return list(zip(things.names[selected], things.bands[selected]))
+    return [(thing["name"], thing["band"]) for i, thing in enumerate(things) if genome is None or genome[i] == 1]
+
+def things_to_arrays(things: list) -> tuple:
+    """
+    Converts a list of things (discs) to a price vector and a want vector.
+
+    Args:
+        things (list): The list of things (discs) with their attributes (or a Wishlist, whose arrays are returned as they are).
+
+    Returns:
+        tuple: The prices and the want levels of the things as numpy arrays.
+    """
+    if isinstance(things, Wishlist):
+        return things.prices, things.wants
+    prices = np.array([thing["price"] for thing in things], dtype=float)
+    wants = np.array([thing["want"] for thing in things], dtype=float)
+    return prices, wants
+
+def population_fitness(population: np.ndarray, prices: np.ndarray, wants: np.ndarray, price_limit) -> np.ndarray:
+    """
+    Calculates the fitness values of a whole population at once.
+
+    Args:
+        population (np.ndarray): The population as a (pop_size x genome_length) matrix of 0s and 1s.
+        prices (np.ndarray): The prices of the things.
+        wants (np.ndarray): The want levels of the things.
+        price_limit (float): The maximum price limit.
+
+    Returns:
+        np.ndarray: The fitness value of each genome (0 if the price limit is exceeded).
+    """
+    fitnesses = population @ wants
+    fitnesses[population @ prices > price_limit] = 0
+    return fitnesses
+
+def selection_pairs_array(population: np.ndarray, weights: np.ndarray, num_pairs: int, rng) -> tuple:
+    """
+    Selects num_pairs pairs of genomes from the population based on their fitness values.
+
+    Args:
+        population (np.ndarray): The population of genomes.
+        weights (np.ndarray): The fitness values of the genomes.
+        num_pairs (int): The number of pairs to select.
+        rng (np.random.Generator): The random generator to use.
+
+    Returns:
+        tuple: The first and the second parents of each pair as two matrices.
+    """
+    size = len(population)
+    total = weights.sum()
+    if total == 0:
+        # same as sample(population, k=2): the genomes of a pair are different.
+        first = rng.integers(size, size=num_pairs)
+        second = (first + rng.integers(1, size, size=num_pairs)) % size
+    else:
+        first, second = rng.choice(size, size=(2, num_pairs), p=weights / total)
+    return population[first], population[second]
+
+def crossover_array(parents_a: np.ndarray, parents_b: np.ndarray, rng) -> tuple:
+    """
+    Performs single point crossover on every pair of parents at once.
+
+    Args:
+        parents_a (np.ndarray): The first parent of each pair.
+        parents_b (np.ndarray): The second parent of each pair.
+        rng (np.random.Generator): The random generator to use.
+
+    Returns:
+        tuple: The first and the second child of each pair as two matrices.
+    """
+    length = parents_a.shape[1]
+    if length < 2:
+        return parents_a.copy(), parents_b.copy()
+    points = rng.integers(1, length, size=len(parents_a))
+    mask = np.arange(length) < points[:, None]  # genes taken from the own parent.
+    return np.where(mask, parents_a, parents_b), np.where(mask, parents_b, parents_a)
+
+def mutation_array(genomes: np.ndarray, rng, num: int = 1, probability: float = 0.5) -> np.ndarray:
+    """
+    Performs mutation on every genome at once (in place).
+
+    Args:
+        genomes (np.ndarray): The genomes to be mutated.
+        rng (np.random.Generator): The random generator to use.
+        num (int, optional): The number of mutations to perform. Defaults to 1.
+        probability (float, optional): The probability of mutation for each gene. Defaults to 0.5.
+
+    Returns:
+        np.ndarray: The mutated genomes.
+    """
+    rows = np.arange(len(genomes))
+    for _ in range(num):
+        index = rng.integers(genomes.shape[1], size=len(genomes))
+        genomes[rows, index] ^= (rng.random(len(genomes)) <= probability).astype(genomes.dtype)
+    return genomes
+
+def run_evolution_array(pop_size, genome_length, things, price_limit, generation_limit, rng=None,
+                        stall_generations=None, time_limit=None, return_generations=False) -> list:
+    """
+    Same as run_evolution, but the population is kept in a numpy matrix, so every
+    step of a generation (fitness, selection, crossover and mutation) is vectorized.
+
+    Args:
+        pop_size (int): The size of the population (number of genomes) in each generation.
+        genome_length (int): The length of each genome.
+        things (list): The list of things (discs) with their attributes.
+        price_limit (float): The maximum price limit.
+        generation_limit (int): The number of generations to evolve.
+        rng (np.random.Generator, optional): The random generator to use. Defaults to a new unseeded one.
+        stall_generations (int, optional): Stops early if the best fitness did not improve for this number of generations. Defaults to None.
+        time_limit (float, optional): Stops early after this number of seconds. Defaults to None.
+        return_generations (bool, optional): Whether to also return the number of generations evolved. Defaults to False.
+
+    Returns:
+        list: The best genome obtained after evolving for the specified number of generations
+            (and the number of generations evolved, if return_generations is True).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    prices, wants = things_to_arrays(things)
+    if len(prices) != genome_length:
+        raise ValueError("genome and things must be of same length")
+    start = time.perf_counter()
+    best_fitness, stalled_for = None, 0
+
+    population = rng.integers(0, 2, size=(pop_size, genome_length), dtype=np.uint8)
+    num_pairs = max(pop_size // 2 - 1, 0)
+    i = generation_limit
+    for generation in range(generation_limit):
+        fitnesses = population_fitness(population, prices, wants, price_limit)
+        elites = population[np.argsort(-fitnesses, kind="stable")[:2]]   # keeps the top 2 solutions (elitism).
+
+        # stops if the population converged or the time is over.
+        if best_fitness is None or fitnesses.max() > best_fitness:
+            best_fitness, stalled_for = fitnesses.max(), 0
+        else:
+            stalled_for += 1
+        if (stall_generations and stalled_for >= stall_generations) or (time_limit and time.perf_counter() - start >= time_limit):
+            i = generation
+            break
+
+        parents_a, parents_b = selection_pairs_array(population, fitnesses, num_pairs, rng)
+        children_a, children_b = crossover_array(parents_a, parents_b, rng)
+        children = mutation_array(np.concatenate((children_a, children_b)), rng)
+        population = np.concatenate((elites, children))
+
+    fitnesses = population_fitness(population, prices, wants, price_limit)
+    best = population[np.argmax(fitnesses)].tolist()    # the best genome.
+    if return_generations:
+        return best, i
+    return best
+
+def batched_fitness(population: np.ndarray, prices: np.ndarray, wants: np.ndarray, price_limits: np.ndarray,
+                    exact: bool = False) -> np.ndarray:
+    """
+    Calculates the fitness values of the populations of many users at once. The want and price sums are
+    computed with one product of the population (converted to float32, 4 bytes per gene) and the stacked
+    wants and prices. float32 sums can be off by a tiny fraction of the price limit, so the final
+    genomes are picked with exact=True (float64, 8 bytes per gene).
+
+    Args:
+        population (np.ndarray): The populations as a (users x pop_size x genome_length) array of 0s and 1s.
+        prices (np.ndarray): The (users x genome_length) prices of the things (0 for padding).
+        wants (np.ndarray): The (users x genome_length) want levels of the things (0 for padding).
+        price_limits (np.ndarray): The price limit of every user.
+        exact (bool, optional): Whether to compute the sums in float64. Defaults to False.
+
+    Returns:
+        np.ndarray: The (users x pop_size) fitness values (0 if the price limit of the user is exceeded).
+    """
+    dtype = np.float64 if exact else np.float32
+    sums = np.matmul(population.astype(dtype), np.stack((wants, prices), axis=2).astype(dtype))
+    fitnesses = sums[:, :, 0]
+    fitnesses[sums[:, :, 1] > price_limits[:, None]] = 0
+    return fitnesses
+
+# max number of genes converted to float64 at once by best_genomes.
+EXACT_FITNESS_CELLS = 4_000_000
+
+def best_genomes(population: np.ndarray, prices: np.ndarray, wants: np.ndarray, price_limits: np.ndarray) -> np.ndarray:
+    """
+    Returns the best genome of the population of every user (with exact fitness values). The users are
+    evaluated in chunks, so the float64 copy of the population stays small.
+
+    Args:
+        population (np.ndarray): The populations as a (users x pop_size x genome_length) array of 0s and 1s.
+        prices (np.ndarray): The (users x genome_length) prices of the things (0 for padding).
+        wants (np.ndarray): The (users x genome_length) want levels of the things (0 for padding).
+        price_limits (np.ndarray): The price limit of every user.
+
+    Returns:
+        np.ndarray: The (users x genome_length) best genome of every user.
+    """
+    users, pop_size, genome_length = population.shape
+    chunk = max(1, EXACT_FITNESS_CELLS // max(1, pop_size * genome_length))
+    best = np.empty((users, genome_length), dtype=population.dtype)
+    for start in range(0, users, chunk):
+        part = slice(start, start + chunk)
+        fitnesses = batched_fitness(population[part], prices[part], wants[part], price_limits[part], exact=True)
+        best[part] = population[part][np.arange(len(fitnesses)), np.argmax(fitnesses, axis=1)]
+    return best
+
+def run_evolution_batched(pop_size, prices, wants, lengths, price_limits, generation_limit, rng=None,
+                          stall_generations=None, return_generations=False) -> np.ndarray:
+    """
+    Same as run_evolution_array, but evolves the populations of many users together. The things of
+    each user are padded to the longest wishlist and the padding genes are always 0.
+    With stall_generations, the users whose population converged are removed from the batch.
+
+    Args:
+        pop_size (int): The size of the population (number of genomes) of each user.
+        prices (np.ndarray): The (users x genome_length) prices of the things (0 for padding).
+        wants (np.ndarray): The (users x genome_length) want levels of the things (0 for padding).
+        lengths (np.ndarray): The number of things (wishlist length) of every user.
+        price_limits (np.ndarray): The price limit of every user.
+        generation_limit (int): The number of generations to evolve.
+        rng (np.random.Generator, optional): The random generator to use. Defaults to a new unseeded one.
+        stall_generations (int, optional): Stops evolving a user if their best fitness did not improve for this number of generations. Defaults to None.
+        return_generations (bool, optional): Whether to also return the number of generations evolved by every user. Defaults to False.
+
+    Returns:
+        np.ndarray: The (users x genome_length) best genome of every user
+            (and the generations evolved by every user, if return_generations is True).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    users, genome_length = prices.shape
+    lengths = np.asarray(lengths)
+    price_limits = np.asarray(price_limits)
+    genes = (np.arange(genome_length) < lengths[:, None]).astype(np.uint8)   # mask of the real (not padding) genes.
+    population = rng.integers(0, 2, size=(users, pop_size, genome_length), dtype=np.uint8) & genes[:, None, :]
+
+    best = np.zeros((users, genome_length), dtype=np.uint8)
+    generations = np.full(users, generation_limit)
+    active = np.arange(users)   # the users still evolving.
+    best_fitness = np.full(users, -np.inf)
+    stalled_for = np.zeros(users, dtype=int)
+
+    num_pairs = max(pop_size // 2 - 1, 0)
+    rows = np.arange(users)[:, None]
+    for i in range(generation_limit):
+        fitnesses = batched_fitness(population, prices, wants, price_limits)
+        elites = population[rows, np.argsort(-fitnesses, axis=1, kind="stable")[:, :2]]   # keeps the top 2 solutions (elitism).
+
+        if stall_generations:
+            # the users whose best fitness stalled keep their best genome and leave the batch.
+            top = fitnesses.max(axis=1)
+            improved = top > best_fitness
+            best_fitness = np.where(improved, top, best_fitness)
+            stalled_for = np.where(improved, 0, stalled_for + 1)
+            done = stalled_for >= stall_generations
+            if done.any():
+                best[active[done]] = best_genomes(population[done], prices[done], wants[done], price_limits[done])
+                generations[active[done]] = i
+                keep = ~done
+                active, population, elites, fitnesses = active[keep], population[keep], elites[keep], fitnesses[keep]
+                prices, wants, lengths, price_limits = prices[keep], wants[keep], lengths[keep], price_limits[keep]
+                best_fitness, stalled_for = best_fitness[keep], stalled_for[keep]
+                rows = np.arange(len(active))[:, None]
+                if len(active) == 0:
+                    break
+
+        if num_pairs == 0:
+            population = elites
+            continue
+
+        # selection: weighted draw per user with inverse cdf; every row is shifted by its index so
+        # all users can be searched at once. Users whose genomes all have 0 fitness draw uniformly.
+        # the population has pop_size genomes only in the first generation (pop_size - 1 after it if pop_size is odd).
+        width = population.shape[1]
+        totals = fitnesses.sum(axis=1, keepdims=True)
+        probabilities = np.where(totals > 0, fitnesses / np.where(totals > 0, totals, 1), 1 / width)
+        cdf = np.cumsum(probabilities, axis=1)
+        cdf[:, -1] = 1
+        draws = rng.random((len(active), 2 * num_pairs))
+        parents = np.searchsorted((cdf + rows).ravel(), (draws + rows).ravel(), side="right").reshape(len(active), -1) - rows * width
+        parents = np.minimum(parents, width - 1)
+        first, second = parents[:, :num_pairs], parents[:, num_pairs:]
+        distinct = (first + rng.integers(1, width, size=first.shape)) % width   # like sample(population, k=2).
+        second = np.where(totals > 0, second, distinct)
+        parents_a, parents_b = population[rows, first], population[rows, second]
+
+        # crossover: users with less than 2 things keep the parents.
+        points = np.where(lengths[:, None] >= 2, 1 + (rng.random((len(active), num_pairs)) * (lengths[:, None] - 1)).astype(int), genome_length)
+        mask = np.arange(genome_length) < points[:, :, None]
+        children = np.concatenate((np.where(mask, parents_a, parents_b), np.where(mask, parents_b, parents_a)), axis=1)
+
+        # mutation: flips one real gene of every child with probability 0.5.
+        index = (rng.random((len(active), 2 * num_pairs)) * lengths[:, None]).astype(int)
+        children[rows, np.arange(2 * num_pairs), index] ^= (rng.random((len(active), 2 * num_pairs)) <= 0.5).astype(np.uint8)
+
+        population = np.concatenate((elites, children), axis=1)
+
+    if len(active):
+        best[active] = best_genomes(population, prices, wants, price_limits)    # the best genome of every user.
+    if return_generations:
+        return best, generations
+    return best
+
+# memory used by the batched engine for every gene of a batch (population, float32 fitness copy and crossover
+# temporaries, measured), and the memory a batch may use when batch_size is not given.
+BATCH_BYTES_PER_GENE = 8
+BATCH_MEMORY_MB = 256
+
+def solve_batched_knapsacks(users, pop_size, generation_limit, batch_size=None, rng=None, stall_generations=None) -> list:
+    """
+    Solves the knapsack of many users with run_evolution_batched, batch_size users at a time.
+    Without batch_size, every batch has as many users as fit in about BATCH_MEMORY_MB
+    (users x pop_size x longest wishlist x BATCH_BYTES_PER_GENE bytes).
+
+    Args:
+        users (list): The users, with their username, money and wanted discs.
+        pop_size (int): The size of the population (number of genomes) of each user.
+        generation_limit (int): The number of generations to evolve.
+        batch_size (int, optional): The number of users evolved together. Defaults to None (picked from the memory budget).
+        rng (np.random.Generator, optional): The random generator to use. Defaults to a new unseeded one.
+        stall_generations (int, optional): Stops evolving a user if their best fitness did not improve for this number of generations. Defaults to None.
+
+    Returns:
+        list: The username, the list of recommended (disc name, disc band) and the generations evolved of every user (in the given order).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    # users with similar wishlist length are batched together, so there is less padding.
+    order = sorted(range(len(users)), key=lambda i: len(users[i]["wanted"]))
+    res = [None] * len(users)
+    sorted_lengths = np.array([max(len(users[i]["wanted"]), 1) for i in order])
+    start = 0
+    while start < len(order):
+        if batch_size:
+            size = batch_size
+        else:
+            # the last user of a batch has the longest wishlist, so the genes of the first n users are n x pop_size x that length.
+            genes = np.arange(1, len(order) - start + 1) * sorted_lengths[start:] * pop_size
+            size = max(1, int(np.searchsorted(genes, BATCH_MEMORY_MB * 2 ** 20 / BATCH_BYTES_PER_GENE, side="right")))
+        batch = order[start:start + size]
+        start += size
+        lengths = np.array([len(users[i]["wanted"]) for i in batch])
+        prices = np.zeros((len(batch), lengths.max()))
+        wants = np.zeros((len(batch), lengths.max()))
+        for row, i in enumerate(batch):
+            prices[row, :lengths[row]], wants[row, :lengths[row]] = things_to_arrays(users[i]["wanted"])
+        price_limits = np.array([users[i]["money"] for i in batch], dtype=float)
+
+        best, generations = run_evolution_batched(pop_size, prices, wants, lengths, price_limits, generation_limit, rng,
+                                                  stall_generations, return_generations=True)
+        for row, i in enumerate(batch):
+            discs = genome_discs(users[i]["wanted"], best[row, :lengths[row]])
+            res[i] = {"username": users[i]["username"], "discs": discs, "generations": int(generations[row]),
+                      "cache_hits": 0, "cache_misses": 0}
+    return res
+
+# genetic algorithm engines that can be used for the knapsack (see GA_ENGINE in README).
+GA_ENGINES = {
+    "list": run_evolution,
+    "array": run_evolution_array,
+    "batched": run_evolution_batched,
+}
+
+# max size (wishlist length x budget steps) of the dynamic programming table for the "auto" solver.
+DP_MAX_CELLS = 10_000_000
+
+def knapsack_dp(things, price_limit, resolution=0.01) -> list:
+    """
+    Solves the knapsack problem exactly using dynamic programming over the (discretized) budget.
+    Prices are rounded up and the price limit is rounded down to multiples of the resolution,
+    so the result never exceeds the price limit.
+
+    Args:
+        things (list): The list of things (discs) with their attributes.
+        price_limit (float): The maximum price limit.
+        resolution (float, optional): The price discretization step (0.01 means cents). Defaults to 0.01.
+
+    Returns:
+        list: The optimal genome (list of 1s and 0s) for the discretized prices.
+    """
+    prices, wants = things_to_arrays(things)
+    weights = np.ceil(np.round(prices / resolution, 6)).astype(np.int64)
+    capacity = int(np.floor(round(price_limit / resolution, 6)))
+    genome = [0] * len(things)
+    if capacity < 0:
+        return genome
+
+    best = np.zeros(capacity + 1)   # best want level for every budget.
+    take = np.zeros((len(things), capacity + 1), dtype=bool)   # whether thing i is taken for every budget.
+    for i, (weight, want) in enumerate(zip(weights, wants)):
+        if weight > capacity:
+            continue
+        candidate = best[:capacity + 1 - weight] + want
+        improves = candidate > best[weight:]
+        take[i, weight:] = improves
+        best[weight:] = np.where(improves, candidate, best[weight:])
+
+    # walks the table backwards to find the taken things.
+    budget = capacity
+    for i in range(len(things) - 1, -1, -1):
+        if take[i, budget]:
+            genome[i] = 1
+            budget -= weights[i]
+    return genome
+
+def choose_solver(things, price_limit, solver="auto", resolution=0.01, dp_max_cells=DP_MAX_CELLS) -> str:
+    """
+    Chooses how the knapsack of a user is solved.
+
+    Args:
+        things (list): The list of things (discs) with their attributes.
+        price_limit (float): The maximum price limit.
+        solver (str, optional): "auto", or "dp"/"ga" to force a solver. Defaults to "auto".
+        resolution (float, optional): The price discretization step of the dp solver. Defaults to 0.01.
+        dp_max_cells (int, optional): The max dp table size for which "auto" chooses dp. Defaults to DP_MAX_CELLS.
+
+    Returns:
+        str: "all" if all things are affordable, "none" if no thing is affordable, else "dp" or "ga".
+    """
+    prices, _ = things_to_arrays(things)
+    if prices.sum() <= price_limit:
+        return "all"
+    if prices.min() >= price_limit:
+        return "none"
+    if solver != "auto":
+        return solver
+    cells = len(things) * (int(price_limit / resolution) + 1)
+    return "dp" if cells <= dp_max_cells else "ga"
+
+def solve_user_knapsack(u, seed, pop_size, generation_limit, engine="list", solver="auto", resolution=0.01, dp_max_cells=DP_MAX_CELLS,
+                        cache_size=4096, stall_generations=None, time_limit=None):
+    """
+    Finds the best combination of discs that a user can buy given their budget.
+
+    Args:
+        u (dict): The user, with their username, money and wanted discs.
+        seed (np.random.SeedSequence): The seed of the user's random generators (None for unseeded).
         pop_size (int): The size of the population (number of genomes) in each generation for the genetic algorithm.
         generation_limit (int): The number of generations to evolve the population.
+        engine (str, optional): The genetic algorithm engine to use ("list" or "array"). Defaults to "list".
+        solver (str, optional): The solver to use ("auto", "dp" or "ga"). Defaults to "auto".
+        resolution (float, optional): The price discretization step of the dp solver. Defaults to 0.01.
+        dp_max_cells (int, optional): The max dp table size for which "auto" chooses dp. Defaults to DP_MAX_CELLS.
+        cache_size (int, optional): The max number of genomes in the fitness cache of the "list" engine. Defaults to 4096.
+        stall_generations (int, optional): Stops the genetic algorithm if the best fitness did not improve for this number of generations. Defaults to None.
+        time_limit (float, optional): Stops the genetic algorithm after this number of seconds. Defaults to None.
 
     Returns:
-        list: A list of dictionaries representing the recommended disc purchases for each user.
+        dict: The username, the list of recommended (disc name, disc band), the generations evolved (0 without the genetic algorithm)
+            and the fitness cache hits and misses (0 without the "list" engine) of the user.
+    """
+    method = choose_solver(u["wanted"], u["money"], solver, resolution, dp_max_cells)
+
+    if method == "all": # if user can afford all wanted discs -> buys them all.
+        return {"username": u["username"], "discs": genome_discs(u["wanted"]), "generations": 0, "cache_hits": 0, "cache_misses": 0}
+    if method == "none":
+        return {"username": u["username"], "discs": [], "generations": 0, "cache_hits": 0, "cache_misses": 0}
+
+    generations = 0
+    cache = None
+    if method == "dp":
+        l = knapsack_dp(u["wanted"], u["money"], resolution)
+    elif engine == "array":
+        l, generations = run_evolution_array(pop_size, len(u["wanted"]), u["wanted"], u["money"], generation_limit, np.random.default_rng(seed),
+                                             stall_generations, time_limit, return_generations=True)
+    else:
+        if seed is not None:
+            seed_random(int(seed.generate_state(1)[0]))
+        things = list(u["wanted"])   # the list engine reads the things as dictionaries many times.
+        cache = FitnessCache(things, u["money"], cache_size)
+        l, generations = run_evolution(pop_size, len(things), things, u["money"], generation_limit, cache,
+                                       stall_generations, time_limit, return_generations=True)
+    return {"username": u["username"], "discs": genome_discs(u["wanted"], l), "generations": generations,
+            "cache_hits": cache.hits if cache else 0, "cache_misses": cache.misses if cache else 0}
+
+def load_user_wants(conn) -> list:
+    """
+    Retrieves the money of every user and the discs they want, with their latest price.
+
+    Args:
+        conn: The database connection object.
+
+    Returns:
+        list: A list of dictionaries with the username, the money and the wanted discs (Wishlist) of each user.
     """
     # the following query returns the username, user's money, the disc name and band (from those the user wants),
     # the wanted level of the disc (from 1 to 5) for this user and the latest price of a disc.
-    query = """
+    ensure_latest_prices(conn)
+    query = f"""
         SELECT ud.username, users.money, ud.disc_name, ud.disc_band, ud.want, dp.values
-        FROM user_wants_discs ud 
-        JOIN (
-            SELECT name, band, MAX(date) AS max_date
-            FROM disc_prices
-            GROUP BY name, band
-        ) max_dp ON ud.disc_name = max_dp.name AND ud.disc_band = max_dp.band
-        JOIN disc_prices dp ON ud.disc_name = dp.name AND ud.disc_band = dp.band AND max_dp.max_date = dp.date
-        JOIN users ON users.username = ud.username;
+        FROM user_wants_discs ud
+        JOIN {LATEST_PRICES_TABLE} dp ON ud.disc_name = dp.name AND ud.disc_band = dp.band
+        JOIN users ON users.username = ud.username
+        ORDER BY ud.username;
     """
     df = pd.read_sql_query(query, conn)
-    df.rename(columns={'values': 'price'}, inplace=True)
+
+    # the rows of every user are contiguous (ordered by username), so the wishlist of a user
+    # is a slice of each column array (a view, not a copy).
+    counts = df.groupby("username", sort=False).size().to_numpy()
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    usernames, money = df["username"].to_numpy(), df["money"].to_numpy()
+    names, bands = df["disc_name"].to_numpy(), df["disc_band"].to_numpy()
+    wants, prices = df["want"].to_numpy(), df["values"].to_numpy()
 
     user_wants = []
-    # Extract unique usernames and corresponding money
-    user_money = df[['username', 'money']].drop_duplicates().reset_index(drop=True)
-    for _, row in user_money.iterrows():
-        username = row['username']
-        filtered_df = df.loc[df['username'] == username]
-        wanted = []
-        for _, disc in filtered_df.iterrows():
-            wanted.append({"name": disc["disc_name"], "band":disc["disc_band"], "want":disc["want"], "price":disc["price"]})
-        d = {"username": username, "money": row["money"], "wanted": wanted}
-        user_wants.append(d)
-
-    res = []
-    for u in user_wants:
-        sum_p = sum(item['price'] for item in u['wanted'])
-
-        if sum_p <= u["money"]: # if user can afford all wanted discs -> buys them all.
-            discs = [(item["name"], item["band"]) for item in u['wanted']]
-            d = {"username": u["username"], "discs": discs}
-            res.append(d)
-            continue
+    for start, end in zip(starts, ends):
+        wanted = Wishlist(names[start:end], bands[start:end], wants[start:end], prices[start:end])
+        user_wants.append({"username": usernames[start], "money": money[start], "wanted": wanted})
+    return user_wants
 
-        min_price = min(u["wanted"], key=lambda x: x['price'])['price']
-        if min_price < u["money"]:
-            # print(min_price, u["money"])
-            l = run_evolution(pop_size, len(u["wanted"]), u["wanted"], u["money"], generation_limit)
-            w_d = []
-            for i, w in enumerate(l):
-                if w == 1:
-                    w_d.append((u["wanted"][i]["name"], u["wanted"][i]["band"]))
-            res.append({"username":u["username"], "discs":w_d})
-        else:
-            res.append({"username":u["username"], "discs":[]})
-        # print(pop_size, len(u["wanted"]), u["wanted"], u["money"], generation_limit)       
+def user_seed(seed, username: str):
+    """
+    Returns the seed of the random generators of a user, which depends only on the run seed and the username
+    (so the result of a user is the same whatever other users are solved with it).
+
+    Args:
+        seed (int): The seed of the run (None for unseeded).
+        username (str): The username of the user.
+
+    Returns:
+        np.random.SeedSequence: The seed of the user (None if the run is unseeded).
+    """
+    if seed is None:
+        return None
+    return np.random.SeedSequence([seed, zlib.crc32(username.encode())])
+
+def solve_knapsacks(user_wants, pop_size, generation_limit, engine="list", solver="auto", resolution=0.01, dp_max_cells=DP_MAX_CELLS,
+                    seed=None, workers=1, chunk_size=None, batch_size=None, cache_size=4096, stall_generations=None, time_limit=None):
+    """
+    Finds the best combination of discs that each of the given users can buy given their budget constraints.
+
+    Args:
+        user_wants (list): The users, with their username, money and wanted discs (see load_user_wants).
+        pop_size (int): The size of the population (number of genomes) in each generation for the genetic algorithm.
+        generation_limit (int): The number of generations to evolve the population.
+        engine (str, optional): The genetic algorithm engine to use ("list", "array" or "batched"). Defaults to "list".
+        solver (str, optional): The solver to use for each user: "auto" chooses dynamic programming when its table
+            is small enough and the genetic algorithm otherwise, "dp" or "ga" force a solver. Defaults to "auto".
+        resolution (float, optional): The price discretization step of the dp solver. Defaults to 0.01.
+        dp_max_cells (int, optional): The max dp table size for which "auto" chooses dp. Defaults to DP_MAX_CELLS.
+        seed (int, optional): Seed for reproducible results; every user gets its own random generator from it,
+            so the results do not depend on the number of workers. Defaults to None.
+        workers (int, optional): The number of processes solving users in parallel. Defaults to 1 (no pool).
+        chunk_size (int, optional): The number of users sent to a worker at a time. Defaults to None,
+            which splits the users in 4 chunks per worker.
+        batch_size (int, optional): The number of users evolved together by the "batched" engine. Defaults to None
+            (as many as fit in about BATCH_MEMORY_MB).
+        cache_size (int, optional): The max number of genomes in the fitness cache of the "list" engine. Defaults to 4096.
+        stall_generations (int, optional): Stops the genetic algorithm of a user if their best fitness did not improve
+            for this number of generations, so users that converge early use fewer generations. Defaults to None.
+        time_limit (float, optional): Stops the genetic algorithm of a user after this number of seconds
+            (not used by the "batched" engine). Defaults to None.
+
+    Returns:
+        list: A list of dictionaries representing the recommended disc purchases for each user.
+    """
+    if engine not in GA_ENGINES:
+        raise ValueError(f"Unknown genetic algorithm engine: {engine}")
+    if solver not in ("auto", "dp", "ga"):
+        raise ValueError(f"Unknown knapsack solver: {solver}")
+
+    # every user gets an independent seed, so the results are the same for serial and parallel runs.
+    seeds = [user_seed(seed, u["username"]) for u in user_wants]
+    solve = partial(solve_user_knapsack, pop_size=pop_size, generation_limit=generation_limit, engine=engine,
+                    solver=solver, resolution=resolution, dp_max_cells=dp_max_cells, cache_size=cache_size,
+                    stall_generations=stall_generations, time_limit=time_limit)
+
+    # the "batched" engine evolves all users that need the genetic algorithm together.
+    batched = []
+    if engine == "batched":
+        batched = [i for i, u in enumerate(user_wants) if choose_solver(u["wanted"], u["money"], solver, resolution, dp_max_cells) == "ga"]
+    single = sorted(set(range(len(user_wants))) - set(batched))
+
+    res = [None] * len(user_wants)
+    if workers > 1:
+        if not chunk_size:
+            chunk_size = max(1, len(single) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map keeps the order of the users.
+            results = executor.map(solve, [user_wants[i] for i in single], [seeds[i] for i in single], chunksize=chunk_size)
+            for i, r in zip(single, results):
+                res[i] = r
+    else:
+        for i in single:
+            res[i] = solve(user_wants[i], seeds[i])
+
+    if batched:
+        results = solve_batched_knapsacks([user_wants[i] for i in batched], pop_size, generation_limit, batch_size, np.random.default_rng(seed),
+                                          stall_generations)
+        for i, r in zip(batched, results):
+            res[i] = r
     return res
 
-def load_db_wanted_knapsack(conn, population_size, generation_limit):
+def genetic_knapshack(conn, pop_size, generation_limit, **options):
+    """
+    Performs a genetic algorithm-based optimization to find the best combination of discs that users can buy given their budget constraints.
+
+    Args:
+        conn: The database connection object.
+        pop_size (int): The size of the population (number of genomes) in each generation for the genetic algorithm.
+        generation_limit (int): The number of generations to evolve the population.
+        **options: Extra options of solve_knapsacks (engine, solver, resolution, dp_max_cells, seed, workers, chunk_size,
+            batch_size, cache_size, stall_generations, time_limit).
+
+    Returns:
+        list: A list of dictionaries representing the recommended disc purchases for each user.
+    """
+    return solve_knapsacks(load_user_wants(conn), pop_size, generation_limit, **options)
+
+def knapsack_fingerprint(u, pop_size, generation_limit, options) -> str:
+    """
+    Returns a fingerprint of everything the knapsack result of a user depends on: their budget,
+    their wanted discs with their latest price and the solver settings.
+
+    Args:
+        u (dict): The user, with their username, money and wanted discs.
+        pop_size (int): The size of the population of the genetic algorithm.
+        generation_limit (int): The number of generations of the genetic algorithm.
+        options (dict): The options of solve_knapsacks.
+
+    Returns:
+        str: The fingerprint (sha1 hex digest).
+    """
+    prices, wants = things_to_arrays(u["wanted"])
+    wanted = sorted((name, band, int(want), float(price)) for (name, band), want, price in zip(genome_discs(u["wanted"]), wants, prices))
+    # the number of workers and the chunk size do not change the results.
+    settings = sorted((k, v) for k, v in options.items() if k not in ("workers", "chunk_size"))
+    data = repr((float(u["money"]), wanted, pop_size, generation_limit, settings))
+    return hashlib.sha1(data.encode()).hexdigest()
+
+def load_db_wanted_knapsack(conn, population_size, generation_limit, incremental=False, **options):
     """
     Recommends discs to users using a (genetic) knapsack algorithm and populates a database table with the recommendations.
     Args:
         conn: The database connection object.
         population_size (int): The size of the population (number of genomes) in each generation for the genetic algorithm.
         generation_limit (int): The number of generations to evolve the population.
+        incremental (bool, optional): If True, solves only the users whose fingerprint (budget, wanted discs, latest
+            prices and settings) changed since the last run. Defaults to False (solves all users).
+        **options: Extra options of solve_knapsacks (engine, solver, resolution, dp_max_cells, seed, workers, chunk_size,
+            batch_size, cache_size, stall_generations, time_limit).
     """
     print("Recommending Discs with (Genetic) Knapsack...")
     q = """
@@ -261,20 +950,52 @@ def load_db_wanted_knapsack(conn, population_size, generation_limit):
             REFERENCES discs (name, band)
     )
     """
+    # fingerprint of the input of every user at the last time they were solved.
+    q_fingerprints = """
+    CREATE TABLE IF NOT EXISTS user_knapsack_fingerprints (
+        username VARCHAR(50) PRIMARY KEY,
+        fingerprint CHAR(40) NOT NULL,
+        CONSTRAINT fk_user_knapsack_fingerprints_username FOREIGN KEY (username)
+            REFERENCES users (username)
+    )
+    """
     cursor = conn.cursor()
     cursor.execute(q)
+    cursor.execute(q_fingerprints)
     conn.commit()
 
-    r = genetic_knapshack(conn, population_size, generation_limit)
+    user_wants = load_user_wants(conn)
+    fingerprints = {u["username"]: knapsack_fingerprint(u, population_size, generation_limit, options) for u in user_wants}
+    stored = {}
+    if incremental:
+        cursor.execute("SELECT username, fingerprint FROM user_knapsack_fingerprints")
+        stored = dict(cursor.fetchall())
+    changed = [u for u in user_wants if stored.get(u["username"]) != fingerprints[u["username"]]]
+    removed = [username for username in stored if username not in fingerprints]   # users who do not want any disc now.
+    print(f"Solving knapsack for {len(changed)} of {len(user_wants)} users...")
+
+    r = solve_knapsacks(changed, population_size, generation_limit, **options)
     # print(r)
+    evolved = [user["generations"] for user in r if user["generations"]]
+    if evolved:
+        print(f"Genetic algorithm used {sum(evolved) / len(evolved):.1f} generations per user on average (limit {generation_limit}).")
+    hits, misses = sum(user["cache_hits"] for user in r), sum(user["cache_misses"] for user in r)
+    if hits + misses:
+        print(f"Fitness cache: {hits} hits, {misses} misses ({hits / (hits + misses):.1%} of the fitness values were cached).")
     print("Filling Knapsack Table...")
 
-    for user in r:
-        discs = user["discs"]
-        if discs:
-            for d in discs:
-                insert_query = "INSERT INTO user_rec_discs_knapsack VALUES (%s, %s, %s) ON CONFLICT DO NOTHING"
-                cursor.execute(insert_query, (user["username"], d[0], d[1]))
+    # replaces the recommendations (and fingerprints) of the solved users.
+    if incremental:
+        outdated = [u["username"] for u in changed] + removed
+        cursor.execute("DELETE FROM user_rec_discs_knapsack WHERE username = ANY(%s)", (outdated,))
+        cursor.execute("DELETE FROM user_knapsack_fingerprints WHERE username = ANY(%s)", (outdated,))
+    else:
+        cursor.execute("DELETE FROM user_rec_discs_knapsack")
+        cursor.execute("DELETE FROM user_knapsack_fingerprints")
+    copy_upsert(conn, "user_rec_discs_knapsack", ["username", "disc_name", "disc_band"],
+                ((user["username"], d[0], d[1]) for user in r for d in user["discs"]))
+    copy_upsert(conn, "user_knapsack_fingerprints", ["username", "fingerprint"],
+                ((user["username"], fingerprints[user["username"]]) for user in r))
     conn.commit()
     print("Discs Recommended With Knapsack.")
 
@@ -287,17 +1008,12 @@ def compare_results(conn, username):
         username (str): The username of the user for whom the results are compared.
     """
     # this query gets the specified attributes from the result after knapsack:
-    sql = """
-    SELECT u.username, u.money, d.name AS disc_name, dp.values AS disc_price, ud.want
+    ensure_latest_prices(conn)
+    sql = f"""
+    SELECT u.username, u.money, dp.name AS disc_name, dp.values AS disc_price, ud.want
         FROM users u
         JOIN user_rec_discs_knapsack urd ON u.username = urd.username
-        JOIN (
-            SELECT dp.name, dp.band, MAX(dp.date) AS max_date
-            FROM disc_prices dp
-            GROUP BY dp.name, dp.band
-        ) max_dp ON urd.disc_name = max_dp.name AND urd.disc_band = max_dp.band
-        JOIN discs d ON max_dp.name = d.name AND max_dp.band = d.band
-        JOIN disc_prices dp ON max_dp.name = dp.name AND max_dp.band = dp.band AND max_dp.max_date = dp.date
+        JOIN {LATEST_PRICES_TABLE} dp ON urd.disc_name = dp.name AND urd.disc_band = dp.band
         JOIN user_wants_discs ud ON urd.username = ud.username AND urd.disc_name = ud.disc_name AND urd.disc_band = ud.disc_band
         where urd.username=%s;
     """
@@ -310,17 +1026,12 @@ def compare_results(conn, username):
     print("=========")
 
     # this query gets the results from all wanted discs for the user (with their latest price)
-    sql = """
+    sql = f"""
     SELECT u.username, u.money, uw.disc_name, uw.disc_band, uw.want, dp.values
     FROM users u
     JOIN user_wants_discs uw ON u.username = uw.username
-    JOIN (
-        SELECT d.name, d.band, MAX(dp.date) AS max_date
-        FROM disc_prices dp
-        JOIN discs d ON dp.name = d.name AND dp.band = d.band
-        GROUP BY d.name, d.band
-    ) max_dp ON uw.disc_name = max_dp.name AND uw.disc_band = max_dp.band
-    JOIN disc_prices dp ON max_dp.name = dp.name AND max_dp.band = dp.band AND max_dp.max_date = dp.date where u.username=%s;
+    JOIN {LATEST_PRICES_TABLE} dp ON uw.disc_name = dp.name AND uw.disc_band = dp.band
+    where u.username=%s;
     """
     df = pd.read_sql(sql, conn, params=(username,))
     gn = generate_genome(len(df))   # generates random combination of choices for the user.
@@ -353,14 +1064,8 @@ if __name__ == "__main__":
     # gen_limit = int(os.environ.get('GENERATION_LIMIT', 10))
     # load_db_wanted_knapsack(conn, population_size, gen_limit)
     ## Query to get the results in the database:
-    # SELECT u.username, u.money, d.name AS disc_name, dp.values AS disc_price
+    # SELECT u.username, u.money, dp.name AS disc_name, dp.values AS disc_price
     # FROM users u
     # JOIN user_rec_discs_knapsack urd ON u.username = urd.username
-    # JOIN (
-    #     SELECT dp.name, dp.band, MAX(dp.date) AS max_date
-    #     FROM disc_prices dp
-    #     GROUP BY dp.name, dp.band
-    # ) max_dp ON urd.disc_name = max_dp.name AND urd.disc_band = max_dp.band
-    # JOIN discs d ON max_dp.name = d.name AND max_dp.band = d.band
-    # JOIN disc_prices dp ON max_dp.name = dp.name AND max_dp.band = dp.band AND max_dp.max_date = dp.date
+    # JOIN disc_latest_prices dp ON urd.disc_name = dp.name AND urd.disc_band = dp.band
     # ;
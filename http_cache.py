@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl, urlencode
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# the responses are cached unless HTTP_CACHE=0.
+ENABLED = os.getenv("HTTP_CACHE", "1") != "0"
+# the sqlite file of the cache.
+CACHE_PATH = os.getenv("HTTP_CACHE_PATH", "http_cache.sqlite")
+# if 1, responses are only served from the cache (no network); a url that is not cached fails.
+OFFLINE = os.getenv("HTTP_CACHE_OFFLINE", "0") == "1"
+
+DAY = 24 * 60 * 60
+# seconds a cached response is used without asking the server again, per endpoint (first match).
+ENDPOINT_TTLS = [
+    (r"audioscrobbler\.com/.*method=artist\.getinfo", 7 * DAY),
+    (r"api\.discogs\.com/database/search", 7 * DAY),
+    (r"api\.discogs\.com/artists/\d+/releases", DAY),
+]
+DEFAULT_TTL = DAY
+
+# query parameters with credentials, which are not part of the cache key.
+SECRET_PARAMS = {"api_key", "key", "secret", "token"}
+
+# headers that describe the raw (compressed) body, which are not kept since the decoded body is cached.
+TRANSFER_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+stats = {"hits": 0, "misses": 0, "revalidated": 0}
+
+db = None
+db_lock = threading.Lock()
+
+def get_db() -> sqlite3.Connection:
+    """
+    Opens the cache database (once) and creates its table.
+
+    Returns:
+        sqlite3.Connection: The connection to the cache database.
+    """
+    global db
+    if db is None:
+        db = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        db.commit()
+    return db
+
+def public_url(url: str, params: dict = None) -> str:
+    """
+    Returns the url of a request with its params and without credentials, with the query sorted.
+
+    Args:
+        url (str): The url of the request.
+        params (dict, optional): The extra query parameters of the request. Defaults to None.
+
+    Returns:
+        str: The url without credentials.
+    """
+    url = requests.Request("GET", url, params=params).prepare().url
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS)
+    return parts._replace(query=urlencode(query), fragment="").geturl()
+
+def redact_secrets(text: str) -> str:
+    """
+    Hides the values of the credential query parameters in a text (e.g. the message of a requests error,
+    which contains the url of the request).
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The text with the credentials replaced by ***.
+    """
+    names = "|".join(re.escape(name) for name in sorted(SECRET_PARAMS))
+    return re.sub(rf"(?<![\w])({names})=[^&\s'\"]*", r"\1=***", text)
+
+def cache_key(url: str, params: dict = None) -> str:
+    """
+    Returns the cache key of a GET request: the hash of its url and params (without credentials,
+    so the Authorization header and api keys do not change the key).
+
+    Args:
+        url (str): The url of the request.
+        params (dict, optional): The extra query parameters of the request. Defaults to None.
+
+    Returns:
+        str: The sha256 hex digest of the request.
+    """
+    return hashlib.sha256(f"GET {public_url(url, params)}".encode()).hexdigest()
+
+def ttl(url: str) -> float:
+    """
+    Returns the seconds a response of a url is fresh.
+
+    Args:
+        url (str): The url of the request.
+
+    Returns:
+        float: The time to live of the response.
+    """
+    for pattern, seconds in ENDPOINT_TTLS:
+        if re.search(pattern, url):
+            return seconds
+    return DEFAULT_TTL
+
+def to_response(url: str, row: tuple) -> requests.Response:
+    """
+    Builds a response from a cached row.
+
+    Args:
+        url (str): The url of the request.
+        row (tuple): The status, headers and body of the cached response.
+
+    Returns:
+        requests.Response: The response.
+    """
+    status, headers, body = row
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(json.loads(headers))
+    response._content = body
+    response.url = url
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+def cached_get(send, url: str, **kwargs) -> requests.Response:
+    """
+    Sends a GET request through the cache: fresh responses are served from the cache, stale ones
+    are revalidated with the server (ETag/Last-Modified) and new successful responses are saved.
+    In offline mode only the cache is used.
+
+    Args:
+        send (function): Sends the request (called with url and the kwargs of requests.get).
+        url (str): The url of the request.
+        **kwargs: Extra arguments of requests.get (headers, params, ...).
+
+    Returns:
+        requests.Response: The response.
+
+    Raises:
+        requests.ConnectionError: In offline mode, if the url is not cached.
+    """
+    if not ENABLED:
+        return send(url, **kwargs)
+
+    key = cache_key(url, kwargs.get("params"))
+    with db_lock:
+        row = get_db().execute(
+            "SELECT status, headers, body, etag, last_modified, fetched_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+
+    if row is not None and (OFFLINE or time.time() - row[5] < ttl(url)):
+        with db_lock:
+            stats["hits"] += 1
+        return to_response(url, row[:3])
+    if OFFLINE:
+        raise requests.ConnectionError(f"{public_url(url, kwargs.get('params'))} is not in the http cache (offline mode).")
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if row is not None:
+        if row[3]:
+            headers["If-None-Match"] = row[3]
+        if row[4]:
+            headers["If-Modified-Since"] = row[4]
+    response = send(url, headers=headers, **kwargs)
+
+    if response.status_code == 304 and row is not None:
+        with db_lock:
+            stats["revalidated"] += 1
+            get_db().execute("UPDATE responses SET fetched_at = ? WHERE key = ?", (time.time(), key))
+            get_db().commit()
+        return to_response(url, row[:3])
+
+    with db_lock:
+        stats["misses"] += 1
+        if response.status_code == 200:
+            get_db().execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, public_url(url, kwargs.get("params")), response.status_code,
+                 json.dumps({k: v for k, v in response.headers.items() if k.lower() not in TRANSFER_HEADERS}), response.content,
+                 response.headers.get("ETag"), response.headers.get("Last-Modified"), time.time())
+            )
+            get_db().commit()
+    return response
+
+def clear_cache():
+    """
+    Deletes all cached responses.
+    """
+    with db_lock:
+        get_db().execute("DELETE FROM responses")
+        get_db().commit()
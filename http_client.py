@@ -0,0 +1,220 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import http_cache
+
+load_dotenv()
+
+# max number of open connections kept per host (at least the number of concurrent fetches).
+POOL_SIZE = max(10, int(os.getenv("FETCH_CONCURRENCY", 8)))
+# seconds to wait for a server before failing a request.
+TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))
+# max number of retries of a failed request (connection error, 429 or 5xx).
+RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+# seconds of the first retry delay, which doubles at every retry (with random jitter).
+BACKOFF = float(os.getenv("HTTP_BACKOFF", 1))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# max requests per minute of every host (the documented quotas of the apis).
+RATE_LIMITS = {
+    "api.discogs.com": int(os.getenv("DISCOGS_RATE_LIMIT", 60)),
+    "ws.audioscrobbler.com": int(os.getenv("LASTFM_RATE_LIMIT", 300)),
+}
+
+stats = {"requests": 0, "throttled": 0, "retried": 0, "failed": 0, "wait_seconds": 0.0}
+stats_lock = threading.Lock()
+
+class TokenBucket:
+    """
+    Spreads the requests to a host so that they do not exceed a number of requests per minute.
+    Every request takes a token; tokens are refilled continuously at the rate of the limit and at most
+    capacity tokens are saved for bursts.
+    """
+
+    def __init__(self, per_minute: float, capacity: float = 1):
+        self.rate = per_minute / 60
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        """
+        Adds the tokens earned since the last refill.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """
+        Takes a token, waiting until it is available.
+
+        Returns:
+            float: The seconds waited.
+        """
+        with self.lock:
+            self.refill()
+            # the token is reserved now (tokens can be negative), so waiting threads are served in order.
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float):
+        """
+        Gives no tokens for some seconds (e.g. when the server asks to retry later).
+
+        Args:
+            seconds (float): The seconds to wait before the next request.
+        """
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def set_limit(self, per_minute: float):
+        """
+        Changes the requests per minute of the bucket.
+
+        Args:
+            per_minute (float): The new limit.
+        """
+        with self.lock:
+            self.refill()
+            self.rate = per_minute / 60
+
+buckets = {host: TokenBucket(limit) for host, limit in RATE_LIMITS.items() if limit > 0}
+
+def count(name: str, value: float = 1):
+    """
+    Adds a value to a counter of stats.
+    """
+    with stats_lock:
+        stats[name] += value
+
+def retry_delay(response, attempt: int) -> float:
+    """
+    Returns the seconds to wait before retrying a request: the Retry-After header of the response
+    if it has one, else an exponential backoff with full jitter.
+
+    Args:
+        response (requests.Response): The failed response (None for a connection error).
+        attempt (int): The number of the retry (0 for the first).
+
+    Returns:
+        float: The delay in seconds.
+    """
+    if response is not None:
+        try:
+            return float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            pass
+    return random.uniform(0, BACKOFF * 2 ** attempt)
+
+def send(url: str, **kwargs) -> requests.Response:
+    """
+    Sends a GET request with the pooled session of the host, respecting the rate limit of the host
+    and retrying connection errors, 429 and 5xx responses.
+
+    Args:
+        url (str): The url of the request.
+        **kwargs: Extra arguments of requests.get (headers, params, ...).
+
+    Returns:
+        requests.Response: The response (the last one if all retries failed).
+
+    Raises:
+        requests.RequestException: If the request could not be sent after all retries.
+    """
+    host = urlsplit(url).netloc
+    bucket = buckets.get(host)
+    session = get_session(url)
+    for attempt in range(RETRIES + 1):
+        if bucket is not None:
+            count("wait_seconds", bucket.acquire())
+        count("requests")
+        try:
+            response = session.get(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == RETRIES:
+                count("failed")
+                raise
+            response = None
+        else:
+            if bucket is not None:
+                # discogs reports its quota and the requests left in the current minute.
+                limit = response.headers.get("X-Discogs-Ratelimit", "")
+                if limit.isdigit() and 0 < int(limit) < bucket.rate * 60:
+                    bucket.set_limit(int(limit))
+                if response.headers.get("X-Discogs-Ratelimit-Remaining") == "0":
+                    bucket.pause(1 / bucket.rate)
+            if response.status_code == 429:
+                count("throttled")
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            if attempt == RETRIES:
+                count("failed")
+                return response
+        delay = retry_delay(response, attempt)
+        count("retried")
+        if bucket is not None:
+            bucket.pause(delay)
+        else:
+            time.sleep(delay)
+    return response
+
+# one session (connection pool) per host, shared by all threads.
+sessions = {}
+sessions_lock = threading.Lock()
+
+def get_session(url: str) -> requests.Session:
+    """
+    Returns the session of the host of a url, so the connections to a host are reused.
+
+    Args:
+        url (str): The url of the request.
+
+    Returns:
+        requests.Session: The session of the host.
+    """
+    host = urlsplit(url).netloc
+    with sessions_lock:
+        session = sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            sessions[host] = session
+    return session
+
+def get(url: str, **kwargs) -> requests.Response:
+    """
+    Sends a GET request with the pooled session of the host of the url (like requests.get).
+    The responses are cached on disk (see http_cache.py) and the requests sent to the network are
+    rate limited and retried (see send).
+
+    Args:
+        url (str): The url of the request.
+        **kwargs: Extra arguments of requests.get (headers, params, ...).
+
+    Returns:
+        requests.Response: The response.
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    return http_cache.cached_get(send, url, **kwargs)
+
+def close_sessions():
+    """
+    Closes the sessions (and their connections) of all hosts.
+    """
+    with sessions_lock:
+        for session in sessions.values():
+            session.close()
+        sessions.clear()
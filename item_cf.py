@@ -0,0 +1,288 @@
+import os
+import numpy as np
+import pandas as pd
+import psycopg2
+from scipy import sparse
+from dotenv import load_dotenv
+from db_utils import copy_upsert
+from sparse_utils import top_k_per_row
+
+# table with the top k most similar discs of every disc (the item-item index).
+SIMILARITIES_TABLE = "disc_similarities"
+# table with the item-item collaborative filtering recommendations.
+RECOMMENDATIONS_TABLE = "user_rec_discs_cf"
+
+def create_item_cf_tables(conn):
+    """
+    Creates the similarity and the recommendation tables of the item-item collaborative filtering.
+
+    Args:
+        conn (object): The database connection object.
+
+    Returns:
+        None
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SIMILARITIES_TABLE} (
+            disc_name VARCHAR(250) NOT NULL,
+            disc_band VARCHAR(50) NOT NULL,
+            similar_name VARCHAR(250) NOT NULL,
+            similar_band VARCHAR(50) NOT NULL,
+            similarity FLOAT NOT NULL,
+            PRIMARY KEY (disc_name, disc_band, similar_name, similar_band),
+            FOREIGN KEY (disc_name, disc_band) REFERENCES Discs (name, band),
+            FOREIGN KEY (similar_name, similar_band) REFERENCES Discs (name, band)
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {RECOMMENDATIONS_TABLE} (
+            username VARCHAR(50) NOT NULL,
+            disc_name VARCHAR(250) NOT NULL,
+            disc_band VARCHAR(50) NOT NULL,
+            score FLOAT NOT NULL,
+            PRIMARY KEY (username, disc_name, disc_band),
+            FOREIGN KEY (username) REFERENCES Users (username),
+            FOREIGN KEY (disc_name, disc_band) REFERENCES Discs (name, band)
+        )
+    """)
+    conn.commit()
+
+def load_interactions(conn, want_weight=0.5) -> tuple:
+    """
+    Builds the (users x discs) interaction matrix: 1 for the owned discs and want_weight * want / 5 for the wanted discs.
+
+    Args:
+        conn (object): The database connection object.
+        want_weight (float, optional): The weight of a wanted disc with the max want level (0 ignores the wanted discs). Defaults to 0.5.
+
+    Returns:
+        tuple: The interaction matrix (scipy.sparse.csr_matrix), the usernames and the (name, band) discs of its rows and columns.
+    """
+    usernames = pd.Index(pd.read_sql("SELECT username FROM users ORDER BY username", conn)["username"])
+    discs = pd.MultiIndex.from_frame(pd.read_sql("SELECT name, band FROM discs ORDER BY name, band", conn))
+    owned = pd.read_sql("SELECT username, disc_name, disc_band FROM user_has_discs", conn)
+    wanted = pd.read_sql("SELECT username, disc_name, disc_band, want FROM user_wants_discs", conn)
+
+    def to_matrix(df, values):
+        users = usernames.get_indexer(df["username"])
+        items = discs.get_indexer(pd.MultiIndex.from_arrays([df["disc_name"], df["disc_band"]]))
+        return sparse.csr_matrix((values, (users, items)), shape=(len(usernames), len(discs)))
+
+    interactions = to_matrix(owned, np.ones(len(owned)))
+    if want_weight:
+        # an owned disc keeps weight 1 even if it is also wanted.
+        interactions = interactions.maximum(to_matrix(wanted, want_weight * wanted["want"].to_numpy(dtype=float) / 5))
+    return interactions.tocsr(), usernames, discs
+
+def disc_similarities(interactions, k, memory_budget_mb=256, rows=None) -> tuple:
+    """
+    Computes the cosine similarity of discs (columns of the interaction matrix) and keeps the k most similar
+    discs of every disc. The similarities are computed for a chunk of discs at a time, sized to fit the memory budget.
+
+    Args:
+        interactions (scipy.sparse.csr_matrix): The (users x discs) interaction matrix.
+        k (int): The number of similar discs kept for every disc.
+        memory_budget_mb (float, optional): The approximate memory used by a chunk of similarities. Defaults to 256.
+        rows (np.ndarray, optional): The discs whose similar discs are computed. Defaults to None (all discs).
+
+    Returns:
+        tuple: The discs, the similar discs and the similarities (numpy arrays).
+    """
+    num_discs = interactions.shape[1]
+    norms = np.sqrt(np.asarray(interactions.multiply(interactions).sum(axis=0))).ravel()
+    normalized = sparse.csr_matrix(interactions @ sparse.diags(np.divide(1, norms, out=np.zeros(num_discs), where=norms > 0)))
+    columns = normalized.T.tocsr()
+    if rows is None:
+        rows = np.arange(num_discs)
+
+    # a chunk of similarities takes at most chunk x discs entries (value, index and temporary copies).
+    chunk_size = max(1, int(memory_budget_mb * 2 ** 20 // (24 * max(num_discs, 1))))
+    result = ([], [], [])
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        similarities = (columns[chunk] @ normalized).tocsr()
+        # k + 1 entries, since every disc is the most similar to itself.
+        r, c, v = top_k_per_row(similarities, k + 1)
+        r = chunk[r]
+        not_self = r != c
+        r, c, v = r[not_self], c[not_self], v[not_self]
+        keep = (np.arange(len(r)) - np.searchsorted(r, r)) < k
+        for part, values in zip(result, (r[keep], c[keep], v[keep])):
+            part.append(values)
+    return tuple(np.concatenate(part) if part else np.zeros(0) for part in result)
+
+def score_users(interactions, similarity, users, num_recs) -> tuple:
+    """
+    Recommends to users the discs most similar to the discs they own or want (and do not own). The score of a disc
+    is the sum of its similarities with the discs of the user (weighted by the interaction), so the cost of a user
+    depends only on their number of discs and on the number of similar discs kept per disc.
+
+    Args:
+        interactions (scipy.sparse.csr_matrix): The (users x discs) interaction matrix.
+        similarity (scipy.sparse.csr_matrix): The (discs x discs) matrix of the kept similarities.
+        users (np.ndarray): The users to recommend discs to.
+        num_recs (int): The number of discs recommended to each user.
+
+    Returns:
+        tuple: The users, the discs and the scores of the recommendations (numpy arrays).
+    """
+    user_interactions = interactions[users]
+    scores = sparse.csr_matrix(user_interactions @ similarity)
+    owned = (user_interactions >= 1).astype(float)   # owned discs have interaction 1.
+    scores = scores - scores.multiply(owned)
+    r, c, v = top_k_per_row(scores, num_recs)
+    return users[r], c, v
+
+def write_similarities(conn, discs, rows, cols, values):
+    """
+    Writes the similar discs of the given discs (replacing their previous ones).
+
+    Args:
+        conn (object): The database connection object.
+        discs (pd.MultiIndex): The (name, band) of every disc id.
+        rows (np.ndarray): The discs of the similarities.
+        cols (np.ndarray): The similar discs.
+        values (np.ndarray): The similarities.
+
+    Returns:
+        None
+    """
+    cursor = conn.cursor()
+    names, bands = discs.get_level_values(0), discs.get_level_values(1)
+    refreshed = np.unique(rows)
+    cursor.execute(f"""
+        DELETE FROM {SIMILARITIES_TABLE} s USING unnest(%s::text[], %s::text[]) AS d(name, band)
+        WHERE s.disc_name = d.name AND s.disc_band = d.band
+    """, (list(names[refreshed]), list(bands[refreshed])))
+    copy_upsert(conn, SIMILARITIES_TABLE, ["disc_name", "disc_band", "similar_name", "similar_band", "similarity"],
+                zip(names[rows], bands[rows], names[cols], bands[cols], values.tolist()))
+
+def write_recommendations(conn, usernames, discs, users, rec_users, rec_discs, scores):
+    """
+    Writes the recommendations of the given users (replacing their previous ones).
+
+    Args:
+        conn (object): The database connection object.
+        usernames (pd.Index): The username of every user id.
+        discs (pd.MultiIndex): The (name, band) of every disc id.
+        users (np.ndarray): The users whose recommendations are replaced.
+        rec_users (np.ndarray): The users of the recommendations.
+        rec_discs (np.ndarray): The recommended discs.
+        scores (np.ndarray): The scores of the recommendations.
+
+    Returns:
+        None
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM {RECOMMENDATIONS_TABLE} WHERE username = ANY(%s)", (list(usernames[users]),))
+    copy_upsert(conn, RECOMMENDATIONS_TABLE, ["username", "disc_name", "disc_band", "score"],
+                zip(usernames[rec_users], discs.get_level_values(0)[rec_discs], discs.get_level_values(1)[rec_discs], scores.tolist()))
+
+def load_similarity_matrix(conn, discs):
+    """
+    Reads the similarity table as a sparse matrix.
+
+    Args:
+        conn (object): The database connection object.
+        discs (pd.MultiIndex): The (name, band) of every disc id.
+
+    Returns:
+        scipy.sparse.csr_matrix: The (discs x discs) similarities.
+    """
+    df = pd.read_sql(f"SELECT disc_name, disc_band, similar_name, similar_band, similarity FROM {SIMILARITIES_TABLE}", conn)
+    rows = discs.get_indexer(pd.MultiIndex.from_arrays([df["disc_name"], df["disc_band"]]))
+    cols = discs.get_indexer(pd.MultiIndex.from_arrays([df["similar_name"], df["similar_band"]]))
+    return sparse.csr_matrix((df["similarity"].to_numpy(), (rows, cols)), shape=(len(discs), len(discs)))
+
+def build_item_cf(conn, k=20, num_recs=None, memory_budget_mb=256, want_weight=0.5):
+    """
+    Builds the similarity index of all discs and recommends discs to all users with item-item collaborative filtering.
+
+    Args:
+        conn (object): The database connection object.
+        k (int, optional): The number of similar discs kept for every disc. Defaults to 20.
+        num_recs (int, optional): The number of discs recommended to each user. Defaults to None (NUMBER_REC_DISCS).
+        memory_budget_mb (float, optional): The approximate memory used by a chunk of similarities. Defaults to 256.
+        want_weight (float, optional): The weight of a wanted disc with the max want level (0 ignores the wanted discs). Defaults to 0.5.
+
+    Returns:
+        None
+    """
+    print("Recommending discs with item-item collaborative filtering...")
+    if num_recs is None:
+        load_dotenv()
+        num_recs = int(os.getenv("NUMBER_REC_DISCS", 1))
+    create_item_cf_tables(conn)
+    interactions, usernames, discs = load_interactions(conn, want_weight)
+
+    rows, cols, values = disc_similarities(interactions, k, memory_budget_mb)
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM {SIMILARITIES_TABLE}")
+    write_similarities(conn, discs, rows, cols, values)
+    similarity = sparse.csr_matrix((values, (rows, cols)), shape=(len(discs), len(discs)))
+
+    users = np.arange(len(usernames))
+    cursor.execute(f"DELETE FROM {RECOMMENDATIONS_TABLE}")
+    write_recommendations(conn, usernames, discs, users, *score_users(interactions, similarity, users, num_recs))
+    conn.commit()
+    print("Discs recommended with item-item collaborative filtering.")
+
+def refresh_item_cf(conn, new_rows, k=20, num_recs=None, memory_budget_mb=256, want_weight=0.5):
+    """
+    Updates the similarity index and the recommendations after new ownerships were inserted in user_has_discs.
+    Only the discs whose similarities can change (the new discs and the discs similar to them) are recomputed,
+    and only the users who own or want one of those discs get new recommendations.
+
+    Args:
+        conn (object): The database connection object.
+        new_rows (list): The new (username, disc name, disc band) rows of user_has_discs.
+        k (int, optional): The number of similar discs kept for every disc. Defaults to 20.
+        num_recs (int, optional): The number of discs recommended to each user. Defaults to None (NUMBER_REC_DISCS).
+        memory_budget_mb (float, optional): The approximate memory used by a chunk of similarities. Defaults to 256.
+        want_weight (float, optional): The weight of a wanted disc with the max want level. Defaults to 0.5.
+
+    Returns:
+        None
+    """
+    if not new_rows:
+        return
+    if num_recs is None:
+        load_dotenv()
+        num_recs = int(os.getenv("NUMBER_REC_DISCS", 1))
+    create_item_cf_tables(conn)
+    interactions, usernames, discs = load_interactions(conn, want_weight)
+    new_users = usernames.get_indexer([row[0] for row in new_rows])
+    new_discs = np.unique(discs.get_indexer(pd.MultiIndex.from_tuples([(row[1], row[2]) for row in new_rows], names=discs.names)))
+
+    # the similarity of 2 discs changes only if one of them is a new disc: recomputes the new discs
+    # and every disc with a common user with them.
+    columns = interactions.T.tocsr()
+    common = (columns[new_discs] @ interactions).tocsr()
+    refreshed = np.union1d(new_discs, common.indices)
+    rows, cols, values = disc_similarities(interactions, k, memory_budget_mb, refreshed)
+    write_similarities(conn, discs, rows, cols, values)
+
+    # users whose discs got new similarities.
+    users = np.union1d(new_users, interactions[:, refreshed].tocsc().indices)
+    similarity = load_similarity_matrix(conn, discs)
+    write_recommendations(conn, usernames, discs, users, *score_users(interactions, similarity, users, num_recs))
+    conn.commit()
+    print(f"Item-item collaborative filtering refreshed for {len(refreshed)} discs and {len(users)} users.")
+
+if __name__ == "__main__":
+    # builds the item-item recommendations of an existing database.
+    load_dotenv()
+    conn = psycopg2.connect(
+        host=os.getenv("PSQL_HOST"),
+        database=os.getenv("PSQL_DATABASE"),
+        user=os.getenv("PSQL_USERNAME"),
+        password=os.getenv("PSQL_PASSWORD")
+    )
+    build_item_cf(
+        conn,
+        k=int(os.getenv("ITEM_CF_NEIGHBORS", 20)),
+        memory_budget_mb=float(os.getenv("ITEM_CF_MEMORY_MB", 256)),
+        want_weight=float(os.getenv("ITEM_CF_WANT_WEIGHT", 0.5)),
+    )
+    conn.close()
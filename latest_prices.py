@@ -0,0 +1,139 @@
+import os
+import psycopg2
+from dotenv import load_dotenv
+
+# table with the latest price of every disc (kept up to date by a trigger on disc_prices).
+LATEST_PRICES_TABLE = "disc_latest_prices"
+
+def create_latest_prices(conn):
+    """
+    Creates the latest price table and the trigger that updates it whenever prices are inserted in disc_prices.
+    If the table did not exist, it is filled from the prices already in the database.
+    This locks disc_prices (it replaces the trigger), so it is run once when the tables are created;
+    the readers of the table use ensure_latest_prices.
+
+    Args:
+        conn (object): The database connection object.
+
+    Returns:
+        None
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass(%s)", (LATEST_PRICES_TABLE,))
+    exists = cursor.fetchone()[0] is not None
+
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LATEST_PRICES_TABLE} (
+            name VARCHAR(250) NOT NULL,
+            band VARCHAR(50) NOT NULL,
+            date DATE NOT NULL,
+            values FLOAT,
+            PRIMARY KEY (name, band),
+            FOREIGN KEY (name, band) REFERENCES Discs (name, band)
+        )
+    """)
+    # statement level trigger: all rows of an insert (or COPY) are merged at once.
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION update_{LATEST_PRICES_TABLE}() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO {LATEST_PRICES_TABLE} (name, band, date, values)
+            SELECT DISTINCT ON (name, band) name, band, date, values
+            FROM new_prices
+            ORDER BY name, band, date DESC
+            ON CONFLICT (name, band) DO UPDATE SET date = EXCLUDED.date, values = EXCLUDED.values
+            WHERE {LATEST_PRICES_TABLE}.date <= EXCLUDED.date;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    cursor.execute(f"DROP TRIGGER IF EXISTS {LATEST_PRICES_TABLE}_trigger ON disc_prices")
+    cursor.execute(f"""
+        CREATE TRIGGER {LATEST_PRICES_TABLE}_trigger AFTER INSERT ON disc_prices
+        REFERENCING NEW TABLE AS new_prices
+        FOR EACH STATEMENT EXECUTE PROCEDURE update_{LATEST_PRICES_TABLE}()
+    """)
+    conn.commit()
+
+    if not exists:
+        refresh_latest_prices(conn)
+
+def ensure_latest_prices(conn):
+    """
+    Creates the latest price table and its trigger only if they are missing (e.g. in a database made
+    before this table existed). When they exist, this is a single catalog query that takes no locks.
+    Nothing is done if disc_prices does not exist yet.
+
+    Args:
+        conn (object): The database connection object.
+
+    Returns:
+        None
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT to_regclass('disc_prices') IS NOT NULL, to_regclass(%s) IS NOT NULL, "
+        "EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = to_regclass('disc_prices'))",
+        (LATEST_PRICES_TABLE, f"{LATEST_PRICES_TABLE}_trigger")
+    )
+    has_prices, has_table, has_trigger = cursor.fetchone()
+    if has_prices and not (has_table and has_trigger):
+        create_latest_prices(conn)
+
+def refresh_latest_prices(conn):
+    """
+    Rebuilds the latest price table from all the prices in disc_prices.
+
+    Args:
+        conn (object): The database connection object.
+
+    Returns:
+        None
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"TRUNCATE {LATEST_PRICES_TABLE}")
+    cursor.execute(f"""
+        INSERT INTO {LATEST_PRICES_TABLE} (name, band, date, values)
+        SELECT DISTINCT ON (name, band) name, band, date, values
+        FROM disc_prices
+        ORDER BY name, band, date DESC
+    """)
+    conn.commit()
+    print("Latest disc prices refreshed.")
+
+def get_latest_prices(conn, name: str = None, band: str = None) -> list:
+    """
+    Retrieves the latest price of discs.
+
+    Args:
+        conn (object): The database connection object.
+        name (str, optional): Returns only the discs with this name (case insensitive). Defaults to None.
+        band (str, optional): Returns only the discs of this band. Defaults to None.
+
+    Returns:
+        list: A list of tuples (disc name, band, date, price), the most recent first.
+    """
+    query = f"SELECT name, band, date, values FROM {LATEST_PRICES_TABLE} WHERE TRUE"
+    params = []
+    if name is not None:
+        query += " AND LOWER(name) = LOWER(%s)"
+        params.append(name)
+    if band is not None:
+        query += " AND band = %s"
+        params.append(band)
+    query += " ORDER BY date DESC"
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return cur.fetchall()
+
+if __name__ == "__main__":
+    # creates (or rebuilds) the latest price table of an existing database.
+    load_dotenv()
+    conn = psycopg2.connect(
+        host=os.getenv("PSQL_HOST"),
+        database=os.getenv("PSQL_DATABASE"),
+        user=os.getenv("PSQL_USERNAME"),
+        password=os.getenv("PSQL_PASSWORD")
+    )
+    create_latest_prices(conn)
+    refresh_latest_prices(conn)
+    conn.close()
@@ -1,10 +1,17 @@
-import requests
 import json
 import re
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import execute_values
 import create_db
+import http_client
+import http_cache
 from genetic import load_db_wanted_knapsack
+from item_cf import build_item_cf
 from dotenv import load_dotenv
 import os
 
@@ -14,6 +21,9 @@ YOUR_API_KEY = os.getenv("YOUR_API_KEY")
 
 band_names = os.getenv("BAND_NAMES", "coldplay").split()
 
+# number of releases per page of the Discogs API (max 100).
+DISCOGS_PAGE_SIZE = 100
+
 def find_info_band(band_name: str) -> dict:
     """
     Retrieves information about a band.
@@ -28,13 +38,83 @@ def find_info_band(band_name: str) -> dict:
         None
     """
     band_url = f"http://ws.audioscrobbler.com/2.0/?method=artist.getinfo&artist={band_name}&api_key={YOUR_API_KEY}&format=json"
-    response = requests.get(band_url)
+    response = http_client.get(band_url)
+    response.raise_for_status()
     json_data = json.loads(response.text)
     artist_name = json_data['artist']['name']
     artist_summary = re.sub('<a.*?>.*?</a>', '', json_data['artist']['bio']['summary'])
     return {"name":artist_name, "summary": artist_summary}
 
 
+def discogs_headers() -> dict:
+    """
+    Returns the headers of the (authenticated) Discogs API requests.
+
+    Returns:
+        dict: The headers.
+    """
+    consumer_key = os.getenv("DISCOGS_KEY")
+    consumer_secret = os.getenv("DISCOGS_SECRET")
+    return {
+        'User-Agent': 'MyApp/1.0',
+        'Authorization': 'Discogs key={}, secret={}'.format(consumer_key, consumer_secret)
+    }
+
+
+def find_band_id(band_name: str) -> int:
+    """
+    Retrieves the Discogs id of a band (the most popular artist with this name).
+
+    Parameters:
+        band_name (str): The name of the band to search for.
+
+    Returns:
+        int: The Discogs id of the band.
+    """
+    url = f'https://api.discogs.com/database/search?type=artist&q={band_name}'
+    response = http_client.get(url, headers=discogs_headers())
+    response.raise_for_status()
+    return response.json()["results"][0]["id"]
+
+
+def iter_releases(band_id: int, page_size: int = DISCOGS_PAGE_SIZE):
+    """
+    Retrieves all the releases of a band from the Discogs API, one page at a time.
+
+    Parameters:
+        band_id (int): The Discogs id of the band.
+        page_size (int, optional): The number of releases per page (max 100). Defaults to DISCOGS_PAGE_SIZE.
+
+    Yields:
+        dict: The releases of the band, as they arrive.
+    """
+    url = f'https://api.discogs.com/artists/{band_id}/releases'
+    page, pages = 1, 1
+    while page <= pages:
+        response = http_client.get(url, params={"page": page, "per_page": page_size}, headers=discogs_headers())
+        response.raise_for_status()
+        data = response.json()
+        yield from data["releases"]
+        pages = data.get("pagination", {}).get("pages", 1)
+        page += 1
+
+
+def iter_albums(band_id: int, page_size: int = DISCOGS_PAGE_SIZE):
+    """
+    Retrieves the album (master release) titles of a band.
+
+    Parameters:
+        band_id (int): The Discogs id of the band.
+        page_size (int, optional): The number of releases per page. Defaults to DISCOGS_PAGE_SIZE.
+
+    Yields:
+        str: The album titles.
+    """
+    for r in iter_releases(band_id, page_size):
+        if r["type"] == 'master':
+            yield r["title"]
+
+
 def find_top_albums(band_name: str) -> list:
     """
     Retrieves the top albums by a band using the Discogs API.
@@ -48,40 +128,97 @@ def find_top_albums(band_name: str) -> list:
     Raises:
         None
     """
-    consumer_key = os.getenv("DISCOGS_KEY")
-    consumer_secret = os.getenv("DISCOGS_SECRET")
+    popular_band_id = find_band_id(band_name)
+    return (popular_band_id, list(iter_albums(popular_band_id)))
 
-    url = f'https://api.discogs.com/database/search?type=artist&q={band_name}'
 
-    response = requests.get(url, headers={
-        'User-Agent': 'MyApp/1.0',
-        'Authorization': 'Discogs key={}, secret={}'.format(consumer_key, consumer_secret)
-    })
+def fetch_band(band_name: str, out: queue.Queue, stop: threading.Event, page_size: int = DISCOGS_PAGE_SIZE) -> int:
+    """
+    Retrieves the information and the albums of a band and puts them in a queue as they arrive:
+    first ("band", (name, summary, band_id)), then ("discs", [(album, band), ...]) batches of page_size albums.
 
-    popular_band_id = response.json()["results"][0]["id"]
-    # print(popular_band_id)
+    Parameters:
+        band_name (str): The name of the band to search for.
+        out (queue.Queue): The (bounded) queue of the rows to insert.
+        stop (threading.Event): Set when the rows are no longer consumed.
+        page_size (int, optional): The number of releases per page and of albums per batch. Defaults to DISCOGS_PAGE_SIZE.
 
-    url = f'https://api.discogs.com/artists/{popular_band_id}/releases'
-    releases = requests.get(url).json()
+    Returns:
+        int: The number of albums of the band.
 
-    albums_title = []
-    for r in releases["releases"]:
-        # print(r)
-        if r["type"] == 'master':
-            albums_title.append(r["title"])
-    return (popular_band_id, albums_title)
+    Raises:
+        RuntimeError: If stop is set while waiting for space in the queue.
+    """
+    def put(item):
+        while True:
+            try:
+                out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if stop.is_set():
+                    raise RuntimeError("Band loading stopped.")
+
+    r = find_info_band(band_name)
+    band_id = find_band_id(band_name)
+    put(("band", (r["name"], r["summary"].replace('\n', ' '), band_id)))
+    albums = iter_albums(band_id, page_size)
+    count = 0
+    while True:
+        batch = list(islice(albums, page_size))
+        if not batch:
+            return count
+        put(("discs", [(a, r["name"]) for a in batch]))
+        count += len(batch)
+
+def load_bands(conn, names: list, concurrency: int = 8, page_size: int = DISCOGS_PAGE_SIZE, queue_size: int = 16) -> dict:
+    """
+    Fetches many bands concurrently and inserts their bands and discs while they are fetched: the fetching
+    threads put batches of rows in a bounded queue, which are inserted by the calling thread.
+    A band that fails is reported and skipped (the rows already inserted for it are kept).
 
+    Parameters:
+        conn (object): The database connection object.
+        names (list): The names of the bands.
+        concurrency (int, optional): The max number of bands fetched at the same time. Defaults to 8.
+        page_size (int, optional): The number of releases per page and of albums per batch. Defaults to DISCOGS_PAGE_SIZE.
+        queue_size (int, optional): The max number of batches waiting to be inserted. Defaults to 16.
 
-def load_api():
+    Returns:
+        dict: The error of every failed band.
+    """
+    out = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    cur = conn.cursor()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [executor.submit(fetch_band, b, out, stop, page_size) for b in names]
+        try:
+            while True:
+                try:
+                    kind, rows = out.get(timeout=0.1)
+                except queue.Empty:
+                    # a finished band has put all its rows, so nothing else can arrive.
+                    if all(f.done() for f in futures) and out.empty():
+                        break
+                    continue
+                if kind == "band":
+                    cur.execute("INSERT INTO Bands (name, summary, band_id) VALUES (%s, %s, %s)", rows)
+                else:
+                    execute_values(cur, "INSERT INTO Discs (name, band) VALUES %s ON CONFLICT DO NOTHING", rows)
+        finally:
+            stop.set()
+            cur.close()
+
+    failures = {}
+    for b, future in zip(names, futures):
+        try:
+            print(f"Loaded band {b} ({future.result()} albums).")
+        except Exception as e:
+            failures[b] = e
+            # the messages of requests errors contain the url of the request, with the api key.
+            print(f"Failed to fetch band {b}: {type(e).__name__}: {http_cache.redact_secrets(str(e))}")
+    return failures
 
-    print("Collecting requested band data...")
-    albums_bands = []
-    for b in band_names:
-        r = find_info_band(b)
-        band_id, a = find_top_albums(b)
-        r["albums"] = a
-        r["band_id"] = band_id
-        albums_bands.append(r)
+def load_api():
 
     # Connect to PostgreSQL database
     conn = psycopg2.connect(
@@ -96,44 +233,85 @@ def load_api():
 
     create_db.create_tables(conn)
 
-    # Open a cursor to perform database operations
-    cur = conn.cursor()
+    print("Collecting requested band data...")
+    failures = load_bands(
+        conn, band_names,
+        concurrency=int(os.environ.get('FETCH_CONCURRENCY', 8)),
+        page_size=int(os.environ.get('DISCOGS_PAGE_SIZE', DISCOGS_PAGE_SIZE)),
+        queue_size=int(os.environ.get('FETCH_QUEUE_SIZE', 16)),
+    )
+    print(f"Fetched {len(band_names) - len(failures)} of {len(band_names)} bands.")
+    http_client.close_sessions()
+    print("Http cache: {hits} hits, {revalidated} revalidated, {misses} misses.".format(**http_cache.stats))
+    print("Http requests: {requests} sent, {throttled} throttled, {retried} retried, {failed} failed, "
+          "{wait_seconds:.1f}s waited for rate limits.".format(**http_client.stats))
+
 
-    # Iterate through the data and insert each item into the PostgreSQL table
-    for item in albums_bands:
-        name = item['name']
-        summary = item['summary'].replace('\n', ' ')
-        band_id = item["band_id"]
-        albums = item['albums']
-        cur.execute("INSERT INTO Bands (name, summary, band_id) VALUES (%s, %s, %s)", (name, summary, band_id))
-        for a in albums:
-            #if a != "(null)":
-            cur.execute("INSERT INTO Discs (name, band) VALUES (%s, %s) ON CONFLICT DO NOTHING", (a, name))
-
-
-    create_db.load_users(conn)
-    create_db.insert_user_has_disc(conn)
-    create_db.insert_user_likes_band(conn)
-    create_db.fill_barabasi_model(conn)
-    create_db.fill_user_wants_discs(conn)
+    create_db.load_users(
+        conn,
+        chunk_size=int(os.environ.get('USERS_CHUNK_SIZE', create_db.USERS_CHUNK_SIZE)),
+        workers=int(os.environ.get('USERS_WORKERS', 1)),
+    )
+    data_seed = int(os.environ['DATA_SEED']) if os.environ.get('DATA_SEED') else None
+    create_db.insert_user_has_disc(conn, seed=data_seed, density=float(os.environ.get('USER_DISCS_DENSITY', 0)) or None)
+    create_db.insert_user_likes_band(conn, seed=data_seed, density=float(os.environ.get('USER_BANDS_DENSITY', 0)) or None)
+    create_db.fill_barabasi_model(
+        conn,
+        hops=int(os.environ.get('REC_HOPS', 1)),
+        hop_weights=tuple(float(w) for w in os.environ.get('REC_HOP_WEIGHTS', '1,0.5').split(',')),
+        max_fanout=int(os.environ.get('REC_MAX_FANOUT', 0)) or None,
+        seed=data_seed,
+    )
+    create_db.fill_user_wants_discs(
+        conn,
+        mode=os.environ.get('USER_WANTS_MODE', 'server'),
+        seed=data_seed,
+    )
+    if bool(int(os.environ.get('ITEM_CF', 0))):
+        build_item_cf(
+            conn,
+            k=int(os.environ.get('ITEM_CF_NEIGHBORS', 20)),
+            memory_budget_mb=float(os.environ.get('ITEM_CF_MEMORY_MB', 256)),
+            want_weight=float(os.environ.get('ITEM_CF_WANT_WEIGHT', 0.5)),
+        )
     if bool(int(os.environ.get('LOAD_PRICES', 0))):
         if bool(int(os.environ.get('WEB_SCRAPE_PRICES', 0))):
-            create_db.load_prices_webscrape(conn, int(os.environ.get('MAX_DISC_SCRAPE', -1)))
+            create_db.load_prices_webscrape(
+                conn, int(os.environ.get('MAX_DISC_SCRAPE', -1)),
+                workers=int(os.environ.get('SCRAPE_WORKERS', 1)),
+            )
         else:
             print("Loading synthetic data...")
-            create_db.load_prices(conn)
+            create_db.load_prices(
+                conn, seed=data_seed,
+                jitter=float(os.environ.get('PRICE_JITTER', 0)),
+                offset=float(os.environ.get('PRICE_OFFSET', 0)),
+            )
         population_size = int(os.environ.get('POPULATION_SIZE', 5))
         gen_limit = int(os.environ.get('GENERATION_LIMIT', 10))
-        load_db_wanted_knapsack(conn, population_size, gen_limit)
+        load_db_wanted_knapsack(
+            conn, population_size, gen_limit,
+            engine=os.environ.get('GA_ENGINE', 'list'),
+            solver=os.environ.get('KNAPSACK_SOLVER', 'auto'),
+            resolution=float(os.environ.get('KNAPSACK_PRICE_RESOLUTION', 0.01)),
+            dp_max_cells=int(os.environ.get('KNAPSACK_DP_MAX_CELLS', 10_000_000)),
+            seed=int(os.environ['KNAPSACK_SEED']) if os.environ.get('KNAPSACK_SEED') else None,
+            workers=int(os.environ.get('KNAPSACK_WORKERS', 1)),
+            chunk_size=int(os.environ.get('KNAPSACK_CHUNK_SIZE', 0)),
+            batch_size=int(os.environ.get('KNAPSACK_BATCH_SIZE', 0)) or None,
+            cache_size=int(os.environ.get('FITNESS_CACHE_SIZE', 4096)),
+            stall_generations=int(os.environ.get('GA_STALL_GENERATIONS', 0)) or None,
+            time_limit=float(os.environ.get('GA_TIME_LIMIT', 0)) or None,
+            incremental=bool(int(os.environ.get('KNAPSACK_INCREMENTAL', 0))),
+        )
     else:
         print("Prices not inserted & no execution of genetic algorithm.")
 
     # user has a price, disc have a price.
 
 
-    # Commit the transaction and close the cursor and connection
+    # Commit the transaction and close the connection
     conn.commit()
-    cur.close()
     conn.close()
 
     # print(r)
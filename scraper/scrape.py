@@ -4,6 +4,10 @@ from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.common.by import By
 import time
+import queue
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from scipy.stats.mstats import winsorize
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -14,27 +18,165 @@ import pandas as pd
 from webdriver_manager.firefox import GeckoDriverManager
 
 
-def load_prices_discogs(artist_name, disc_name, MAX_PAGES=10, write_csv=False, plot=False):
+@lru_cache(maxsize=None)
+def chrome_driver_path():
+    # installs chrome driver (once per process).
+    return ChromeDriverManager().install()
 
-    artist_name = str(artist_name)
-    disc_name = disc_name.replace(' ', '-').replace('/', '-')
-    disc_name = '-'.join(filter(None, disc_name.split('-')))
+@lru_cache(maxsize=None)
+def gecko_driver_path():
+    # installs firefox driver (once per process).
+    return GeckoDriverManager().install()
 
-    # print(artist_name, disc_name)
+def new_driver():
+    """
+    Starts a headless browser (Chrome, or Firefox if Chrome cannot start).
 
+    Returns:
+        WebDriver: The driver of the browser.
+    """
     # create Chrome options (no tab):
     try:
         options = Options()
         options.add_argument('--headless')  # remove this if you want the browser to appear.
-        # create Chrome service - installs chrome driver:
-        service = Service(ChromeDriverManager().install())
+        # create Chrome service:
+        service = Service(chrome_driver_path())
         # initialise driver:
-        driver = webdriver.Chrome(service=service, options=options)
-    except: # starts firefox    
+        return webdriver.Chrome(service=service, options=options)
+    except: # starts firefox
         options = webdriver.FirefoxOptions()
         options.add_argument('--headless')  # remove this if you want the browser to appear.
-        service = webdriver.firefox.service.Service(executable_path=GeckoDriverManager().install())
-        driver = webdriver.Firefox(service=service, options=options)# go to url:
+        service = webdriver.firefox.service.Service(executable_path=gecko_driver_path())
+        return webdriver.Firefox(service=service, options=options)
+
+
+class DriverPool:
+    """
+    A pool of up to size browsers, which are started when first needed and reused for many discs
+    (a browser takes seconds to start). Use it with `with`, so the browsers are closed at the end:
+
+        with DriverPool(2) as pool:
+            with pool.driver() as driver:
+                load_prices_discogs(band_id, disc_name, driver=driver)
+    """
+
+    def __init__(self, size=1, factory=new_driver):
+        self.size = max(1, size)
+        self.factory = factory
+        self.idle = queue.Queue()
+        self.drivers = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def driver(self):
+        """
+        Lends a driver (starting a new one if all are busy and the pool is not full) and takes it back
+        with its state (cookies, open page) reset.
+        """
+        driver = self.acquire()
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def acquire(self):
+        """
+        Takes an idle driver, or starts a new one if the pool is not full, else waits for a driver.
+        """
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                start = len(self.drivers) < self.size
+                if start:
+                    self.drivers.append(None)   # reserves the place of the new driver.
+            if start:
+                try:
+                    driver = self.factory()
+                except:
+                    with self.lock:
+                        self.drivers.remove(None)
+                    raise
+                with self.lock:
+                    self.drivers[self.drivers.index(None)] = driver
+                return driver
+            try:
+                # waits for a driver to be returned (or for the place of a closed one).
+                return self.idle.get(timeout=1)
+            except queue.Empty:
+                pass
+
+    def release(self, driver):
+        """
+        Resets the state of a driver and puts it back in the pool (a driver that cannot be reset is closed).
+        """
+        try:
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+        except Exception:
+            self.discard(driver)
+        else:
+            with self.lock:
+                pooled = driver in self.drivers
+            if pooled:
+                self.idle.put(driver)
+            else:   # the pool was closed while the driver was lent.
+                self.discard(driver)
+
+    def discard(self, driver):
+        with self.lock:
+            if driver in self.drivers:
+                self.drivers.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Closes all the browsers of the pool.
+        """
+        with self.lock:
+            drivers, self.drivers = [d for d in self.drivers if d is not None], []
+            self.idle = queue.Queue()
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_prices_discogs(artist_name, disc_name, MAX_PAGES=10, write_csv=False, plot=False, driver=None):
+    """
+    Scrapes the sale prices of a disc from discogs.
+
+    If driver is given (e.g. from a DriverPool) it is used and left open, else a new browser is started
+    and closed at the end.
+    """
+    if driver is not None:
+        return scrape_prices(driver, artist_name, disc_name, MAX_PAGES, write_csv, plot)
+    driver = new_driver()
+    try:
+        return scrape_prices(driver, artist_name, disc_name, MAX_PAGES, write_csv, plot)
+    finally:
+        driver.quit()
+
+
+def scrape_prices(driver, artist_name, disc_name, MAX_PAGES=10, write_csv=False, plot=False):
+
+    artist_name = str(artist_name)
+    disc_name = disc_name.replace(' ', '-').replace('/', '-')
+    disc_name = '-'.join(filter(None, disc_name.split('-')))
+
+    # print(artist_name, disc_name)
 
     discogs_url = "https://www.discogs.com"
 
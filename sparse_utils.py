@@ -0,0 +1,24 @@
+import numpy as np
+from scipy import sparse
+
+def top_k_per_row(matrix, k) -> tuple:
+    """
+    Finds the k largest entries of every row of a sparse matrix. Ties are broken by the column (the smallest first).
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): The matrix (its zero entries are never returned).
+        k (int): The max number of entries of every row.
+
+    Returns:
+        tuple: The rows, the columns and the values of the entries, sorted by row and value (numpy arrays).
+    """
+    matrix = sparse.csr_matrix(matrix)
+    matrix.eliminate_zeros()
+    matrix.sort_indices()
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    # the entries are in (row, column) order, so two stable sorts (by value, then by row) keep ties by column.
+    order = np.argsort(-matrix.data, kind="stable")
+    order = order[np.argsort(rows[order], kind="stable")]
+    rank = np.arange(len(order)) - matrix.indptr[rows[order]]
+    top = order[rank < k]
+    return rows[top], matrix.indices[top], matrix.data[top]